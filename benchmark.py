@@ -0,0 +1,183 @@
+# benchmark for claudeDefender checks against a synthetic MCP server fleet
+# python benchmark.py --servers 15 --files 2000 > bench_output.txt
+
+from dataclasses import replace
+from pathlib import Path
+import argparse
+import tempfile
+import random
+import shutil
+import json
+import time
+import sys
+import os
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+##################
+# fleet
+
+def make_fleet(home: Path, servers: int, files: int, file_size: int, decoys: int, seed: int = 0) -> Path:
+    # server trees plus a config pointing at them, laid out where claudeDefender looks for it
+    rng = random.Random(seed)
+    os.environ["HOME"] = str(home)
+    os.environ["USERPROFILE"] = str(home)
+    import claudeDefender
+    config_path = claudeDefender.get_config_path()
+    config_path.parent.mkdir(parents=True, exist_ok=True)
+
+    extensions = [".js", ".ts", ".json", ".py", ".mjs"]
+    mcp_servers = {}
+    for s in range(servers):
+        root = home / "mcp" / f"server{s}"
+        for f in range(files):
+            # a few levels of nesting, like real packages
+            rel = Path(f"src/mod{f % 17}/sub{f % 5}/file{f}{extensions[f % len(extensions)]}")
+            write_synthetic(root / rel, rng, file_size)
+        # big node_modules trees that must be pruned, not walked
+        for f in range(decoys):
+            write_synthetic(root / "node_modules" / f"dep{f % 50}" / f"index{f}.js", rng, 256)
+        mcp_servers[f"server{s}"] = {"command": "node", "args": [str(root)]}
+
+    config_path.write_text(json.dumps({"mcpServers": mcp_servers}, indent=2))
+    return config_path
+
+def write_synthetic(path: Path, rng: random.Random, size: int):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # source-like text so deltas and diffs behave as on real code
+    size = max(1, int(rng.expovariate(1 / size)))
+    lines = []
+    total = 0
+    while total < size:
+        line = f"const v{rng.randrange(1 << 20)} = require('{rng.randrange(1 << 16):x}');\n"
+        lines.append(line)
+        total += len(line)
+    path.write_text("".join(lines))
+
+def mutate_fleet(home: Path, fraction: float, seed: int = 1) -> int:
+    rng = random.Random(seed)
+    changed = 0
+    for path in sorted((home / "mcp").glob("server*/src/**/*.*")):
+        if rng.random() < fraction:
+            with open(path, "a") as f:
+                f.write(f"fetch('http://evil.example/{rng.randrange(1 << 30)}');\n")
+            changed += 1
+    return changed
+
+##################
+# measure
+
+def read_proc_io() -> dict:
+    # linux only, rchar counts page cache hits too, read_bytes only real disk reads
+    try:
+        with open("/proc/self/io") as f:
+            return {k: int(v) for k, v in (line.split(": ") for line in f)}
+    except OSError:
+        return {}
+
+def peak_rss_kib() -> int | None:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macos reports bytes, linux kilobytes
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+def measure(name: str, fn) -> tuple[dict, object]:
+    io_before = read_proc_io()
+    start = time.perf_counter()
+    result = fn()
+    wall = time.perf_counter() - start
+    io_after = read_proc_io()
+    record = {"phase": name, "wall_s": round(wall, 4), "peak_rss_kib": peak_rss_kib()}
+    for key, out in (("rchar", "bytes_read"), ("read_bytes", "disk_bytes_read"), ("syscr", "read_syscalls"), ("syscw", "write_syscalls")):
+        if key in io_before:
+            record[out] = io_after[key] - io_before[key]
+    return record, result
+
+def diff_all(changes: dict, server_paths: dict) -> int:
+    # same work the review window does when every modified file is opened
+    import claudeDefender
+    lines = 0
+    for server_name, file_changes in changes.get("server_changes", {}).items():
+        for f in file_changes["modified"]:
+            lines += len(claudeDefender.compute_file_diff(server_name, f, "modified", file_changes, server_paths))
+    return lines
+
+##################
+
+def run(args) -> dict:
+    home = Path(tempfile.mkdtemp(prefix="claudeDefender-bench-"))
+    try:
+        record, config_path = measure("generate", lambda: make_fleet(home, args.servers, args.files, args.file_size, args.decoys))
+        import claudeDefender
+        options = claudeDefender.ScanOptions(jobs=args.jobs, algo=args.hash_algo)
+        phases = [record]
+
+        # cold: no state, no hash cache, every file read, hashed and snapshotted
+        record, _ = measure("check_cold", lambda: claudeDefender.check_for_changes(options))
+        phases.append(record)
+
+        # files younger than the racy window are not cached yet
+        time.sleep(claudeDefender.RACY_WINDOW_NS / 1e9)
+        claudeDefender.check_for_changes(options)
+
+        record, _ = measure("check_warm", lambda: claudeDefender.check_for_changes(options))
+        phases.append(record)
+        record, hashes = measure("hash_all_servers_warm", lambda: claudeDefender.hash_all_servers(config_path, options))
+        phases.append(record)
+        record, _ = measure("hash_all_servers_paranoid", lambda: claudeDefender.hash_all_servers(config_path, replace(options, paranoid=True)))
+        phases.append(record)
+
+        changed = mutate_fleet(home, args.change_fraction)
+        record, (_, _, changes) = measure("check_changed", lambda: claudeDefender.check_for_changes(options))
+        record["files_changed"] = changed
+        phases.append(record)
+
+        state_hashes = claudeDefender.load_state()["server_hashes"]
+        record, _ = measure("compare_server_hashes", lambda: claudeDefender.compare_server_hashes(hashes, state_hashes))
+        phases.append(record)
+
+        server_paths = claudeDefender.get_server_paths(config_path)
+        record, lines = measure("diff_generation", lambda: diff_all(changes, server_paths))
+        record["diff_lines"] = lines
+        phases.append(record)
+
+        store_bytes = sum(p.stat().st_size for p in claudeDefender.get_snapshots_path().rglob("*") if p.is_file())
+        return {
+            "python": sys.version.split()[0],
+            "platform": sys.platform,
+            "params": vars(args),
+            "tracked_files": sum(len(v) for v in state_hashes.values()),
+            "snapshot_store_bytes": store_bytes,
+            "phases": phases,
+        }
+    finally:
+        if not args.keep:
+            shutil.rmtree(home, ignore_errors=True)
+        else:
+            print(f"fleet kept in {home}", file=sys.stderr)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark claudeDefender on a synthetic MCP server fleet")
+    parser.add_argument("--servers", type=int, default=15, help="Number of MCP servers in the config")
+    parser.add_argument("--files", type=int, default=500, help="Tracked files per server")
+    parser.add_argument("--file-size", type=int, default=4096, help="Mean file size in bytes (exponential)")
+    parser.add_argument("--decoys", type=int, default=2000, help="node_modules files per server that should be pruned")
+    parser.add_argument("--change-fraction", type=float, default=0.02, help="Share of files modified before the changed check")
+    parser.add_argument("--jobs", type=int, default=min(8, os.cpu_count() or 1), help="Hashing threads")
+    parser.add_argument("--hash-algo", default="blake2b", help="Digest to benchmark")
+    parser.add_argument("--keep", action="store_true", help="Keep the generated fleet for inspection")
+    parser.add_argument("--output", type=Path, help="Write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    report = json.dumps(run(args), indent=2, default=str)
+    if args.output:
+        args.output.write_text(report + "\n")
+    else:
+        print(report)
+
+if __name__ == "__main__":
+    main()
@@ -51,264 +51,3174 @@ _________ .__                   .___     ________          _____
 
 # from plyer import notification
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
+from collections import deque
+from collections.abc import ItemsView, Mapping, MutableMapping
+from array import array
+from urllib.parse import quote, unquote
 from pathlib import Path
-from tkinter import ttk
-import tkinter as tk
 import subprocess
+import traceback
+import socket
 import threading
+import select
+import struct
+import queue
+import errno
 import argparse
+import tempfile
+import shutil
 import hashlib
-import difflib
+import sqlite3
+import zlib
+import itertools
+import functools
+import bisect
 import json
 import time
+import re
 import sys
 import os
 
 # config paths
-def get_config_path() -> Path:
+# fleet mode points these at another profile for a while, see use_profile
+_profile = None
+
+def get_config_path(home: Path = None) -> Path:
+    if home is None and _profile:
+        return _profile[0]
+    home = home or Path.home()
     if sys.platform == "win32":
-        return Path.home() / "AppData" / "Roaming" / "Claude" / "claude_desktop_config.json"
+        return home / "AppData" / "Roaming" / "Claude" / "claude_desktop_config.json"
     elif sys.platform == "darwin":
-        return Path.home() / "Library" / "Application Support" / "Claude" / "claude_desktop_config.json"
+        return home / "Library" / "Application Support" / "Claude" / "claude_desktop_config.json"
     else:
-        return Path.home() / ".config" / "Claude" / "claude_desktop_config.json"
+        return home / ".config" / "Claude" / "claude_desktop_config.json"
 
-def get_state_path() -> Path:
+def get_state_path(home: Path = None) -> Path:
+    if home is None and _profile:
+        return _profile[1] / "state.json"
+    home = home or Path.home()
     if sys.platform == "win32":
-        return Path.home() / "AppData" / "Local" / "MCPMonitor" / "state.json"
+        return home / "AppData" / "Local" / "MCPMonitor" / "state.json"
     elif sys.platform == "darwin":
-        return Path.home() / "Library" / "Application Support" / "MCPMonitor" / "state.json"
+        return home / "Library" / "Application Support" / "MCPMonitor" / "state.json"
     else:
-        return Path.home() / ".local" / "share" / "MCPMonitor" / "state.json"
+        return home / ".local" / "share" / "MCPMonitor" / "state.json"
+
+def home_of_config(config_path: Path) -> Path | None:
+    # the home dir a config sits in when it is at the standard place under one
+    rel_parts = get_config_path(Path()).parts
+    if config_path.parts[-len(rel_parts):] != rel_parts:
+        return None
+    return Path(*config_path.parts[:-len(rel_parts)])
+
+def get_profile_home() -> Path | None:
+    # whose package caches npx/uvx servers run from. None for a fleet profile with no
+    # known home, its servers cannot be told apart from the ones of the user checking
+    return _profile[2] if _profile else Path.home()
+
+def get_user_env(name: str) -> str | None:
+    # the environment is the one of the user running the check, not of a fleet profile
+    return None if _profile and _profile[2] != Path.home() else os.environ.get(name)
+
+@contextmanager
+def use_profile(config_path: Path, state_dir: Path, home: Path = None):
+    # every path helper below follows the profile until the block ends
+    global _profile
+    previous = _profile
+    _profile = (config_path, state_dir, home)
+    try:
+        yield
+    finally:
+        _profile = previous
 
 def get_snapshots_path() -> Path:
     return get_state_path().parent / "snapshots"
 
+def get_objects_path() -> Path:
+    return get_snapshots_path() / "objects"
+
+def get_manifests_path() -> Path:
+    return get_snapshots_path() / "manifests"
+
+def get_history_path() -> Path:
+    return get_snapshots_path() / "history"
+
+def get_diffs_path() -> Path:
+    return get_snapshots_path() / "diffs"
+
+def get_hash_cache_path() -> Path:
+    # json cache from before state.db, only read to migrate it
+    return get_state_path().parent / "hash_cache.json"
+
+def get_state_db_path() -> Path:
+    return get_state_path().parent / "state.db"
+
+def get_ignore_path() -> Path:
+    return get_state_path().parent / "ignore"
+
+def get_socket_path() -> Path:
+    # in a dir of its own that only we can enter, see DaemonServer
+    return get_state_path().parent / "run" / "daemon.sock"
+
+def get_metrics_path() -> Path:
+    return get_state_path().parent / "metrics.ndjson"
+
+def get_profiles_path() -> Path:
+    return get_state_path().parent / "profiles"
+
+def get_backups_path() -> Path:
+    return get_state_path().parent / "backups"
+
+def get_fleet_path() -> Path:
+    # --home profiles keep their state here, under the name of the home dir, never in the
+    # user's own MCPMonitor: their monitor would lose the changes this recorded
+    return get_state_path().parent / "fleet"
+
+##################
+# metrics
+# counters and phase timers for the current check, shared by every thread.
+# phases run on worker threads (hash, snapshot_write) add up their time across threads
+
+METRICS_MAX_BYTES = 1024 * 1024
+METRICS_BACKUPS = 3
+PROFILE_TOP = 30
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.timers = {}
+
+    def count(self, name: str, n: int = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def add_time(self, name: str, seconds: float):
+        with self.lock:
+            total, calls = self.timers.get(name, (0.0, 0))
+            self.timers[name] = (total + seconds, calls + 1)
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def take(self) -> dict:
+        # everything counted so far, and starts over
+        with self.lock:
+            timers, self.timers = self.timers, {}
+            counters, self.counters = self.counters, {}
+        return {
+            "phases": {name: {"seconds": round(total, 6), "calls": calls} for name, (total, calls) in timers.items()},
+            "counters": counters
+        }
+
+metrics = Metrics()
+
+def write_metrics(record: dict):
+    # one json line per check, the file rotates to .1 .. .METRICS_BACKUPS past METRICS_MAX_BYTES
+    metrics_path = get_metrics_path()
+    try:
+        metrics_path.parent.mkdir(parents=True, exist_ok=True)
+        if metrics_path.exists() and metrics_path.stat().st_size > METRICS_MAX_BYTES:
+            for i in range(METRICS_BACKUPS - 1, 0, -1):
+                older = metrics_path.with_name(f"{metrics_path.name}.{i}")
+                if older.exists():
+                    os.replace(older, metrics_path.with_name(f"{metrics_path.name}.{i + 1}"))
+            os.replace(metrics_path, metrics_path.with_name(f"{metrics_path.name}.1"))
+        with open(metrics_path, "a") as f:
+            f.write(json.dumps(record, default=str) + "\n")
+    except OSError:
+        pass
+
+def check_metrics(mode: str, changed: bool | None, options, **fields) -> dict:
+    return {
+        "time": datetime.now().isoformat(),
+        "host": socket.gethostname(),
+        "pid": os.getpid(),
+        "mode": mode,
+        "changed": changed,
+        "algo": options.algo,
+        "jobs": options.jobs,
+        **fields,
+        **metrics.take()
+    }
+
+@contextmanager
+def profiling(enabled: bool):
+    # cProfile only sees the calling thread, run with --jobs 1 to see hashing
+    if not enabled:
+        yield
+        return
+    import cProfile
+    import tracemalloc
+    tracemalloc.start()
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiles_dir = get_profiles_path()
+        profiles_dir.mkdir(parents=True, exist_ok=True)
+        stem = f"check-{datetime.now().strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+        profiler.dump_stats(profiles_dir / f"{stem}.prof")
+        current, peak = tracemalloc.get_traced_memory()
+        top = tracemalloc.take_snapshot().statistics("lineno")[:PROFILE_TOP]
+        tracemalloc.stop()
+        lines = [f"current {current} B, peak {peak} B"] + [str(stat) for stat in top]
+        (profiles_dir / f"{stem}.mem.txt").write_text("\n".join(lines) + "\n")
+        print(f"Profile written to {profiles_dir / stem}.prof (open with python -m pstats)")
+
+##################
+# walk
+# scandir walker that prunes excluded dirs before descending into them
+
+TRACKED_EXTENSIONS = {'.py', '.js', '.ts', '.mjs', '.cjs', '.json', '.yaml', '.yml', '.sh', '.bat'}
+DEFAULT_EXCLUDES = ["node_modules/", "__pycache__/", ".git/", "venv/", ".venv/"]
+
+def glob_to_regex(pattern: str) -> str:
+    # gitignore flavour: * and ? stop at /, ** crosses dirs
+    out = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if pattern.startswith("**/", i):
+            out.append("(?:.*/)?")
+            i += 3
+            continue
+        if pattern.startswith("**", i):
+            out.append(".*")
+            i += 2
+            continue
+        if c == "*":
+            out.append("[^/]*")
+        elif c == "?":
+            out.append("[^/]")
+        elif c == "[":
+            end = pattern.find("]", i + 1)
+            if end == -1:
+                out.append(re.escape(c))
+            else:
+                body = pattern[i + 1:end]
+                if body.startswith("!"):
+                    body = "^" + body[1:]
+                out.append(f"[{body}]")
+                i = end
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return "".join(out)
+
+class IgnoreRules:
+    # last matching rule wins, "!pattern" re-includes, like .gitignore
+    def __init__(self, lines: list[str] = ()):
+        self.rules = []
+        for line in lines:
+            self.add(line)
+
+    def add(self, line: str):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            return
+        include = line.startswith("!")
+        if include:
+            line = line[1:]
+        dir_only = line.endswith("/")
+        line = line.rstrip("/")
+        # a slash anywhere but the end anchors the pattern to the server root
+        anchored = "/" in line
+        line = line.lstrip("/")
+        prefix = "" if anchored else "(?:.*/)?"
+        regex = re.compile(f"{prefix}{glob_to_regex(line)}")
+        self.rules.append((regex, include, dir_only))
+
+    def key(self) -> tuple:
+        return tuple((regex.pattern, include, dir_only) for regex, include, dir_only in self.rules)
+
+    def match(self, rel_path: str, is_dir: bool) -> bool | None:
+        # True excluded, False included by a ! rule, None no rule matched
+        result = None
+        for regex, include, dir_only in self.rules:
+            if dir_only and not is_dir:
+                continue
+            if regex.fullmatch(rel_path):
+                result = not include
+        return result
+
+def load_ignore_rules(excludes: list[str] = (), includes: list[str] = ()) -> IgnoreRules:
+    lines = list(DEFAULT_EXCLUDES)
+    ignore_path = get_ignore_path()
+    if ignore_path.exists():
+        try:
+            lines += ignore_path.read_text().splitlines()
+        except Exception:
+            pass
+    lines += list(excludes)
+    lines += [f"!{p}" for p in includes]
+    return IgnoreRules(lines)
+
+def walk_tree(root: Path, rules: IgnoreRules, start: str = ""):
+    # yields (rel_dir, [(rel_path, DirEntry)]) for every dir that is not pruned, paths use /
+    stack = [start.replace(os.sep, "/")]
+    while stack:
+        rel_dir = stack.pop()
+        try:
+            with os.scandir(os.path.join(root, rel_dir)) as it:
+                entries = sorted(it, key=lambda e: e.name)
+        except OSError:
+            continue
+        subdirs = []
+        files = []
+        pruned = 0
+        for entry in entries:
+            rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+            try:
+                # symlinked dirs are not followed, same as rglob
+                if entry.is_dir(follow_symlinks=False):
+                    if not rules.match(rel_path, True):
+                        subdirs.append(rel_path)
+                    else:
+                        pruned += 1
+                    continue
+                if not entry.is_file():
+                    continue
+            except OSError:
+                continue
+            files.append((rel_path, entry))
+        metrics.count("dirs_walked")
+        if pruned:
+            metrics.count("dirs_pruned", pruned)
+        yield rel_dir, files
+        stack.extend(reversed(subdirs))
+
+def walk_files(root: Path, extensions: set = None, rules: IgnoreRules = None, start: str = ""):
+    # yields (rel_path, DirEntry) for every tracked file under root, or under root/start
+    if extensions is None:
+        extensions = TRACKED_EXTENSIONS
+    if rules is None:
+        rules = load_ignore_rules()
+
+    for _, files in walk_tree(root, rules, start):
+        tracked = []
+        for rel_path, entry in files:
+            verdict = rules.match(rel_path, False)
+            if verdict or (verdict is None and os.path.splitext(entry.name)[1].lower() not in extensions):
+                continue
+            tracked.append((rel_path.replace("/", os.sep), entry))
+        metrics.count("files_walked", len(tracked))
+        yield from tracked
+
+def is_tracked(rel_path: str, extensions: set = None, rules: IgnoreRules = None, is_dir: bool = False) -> bool:
+    # same verdict walk_files would give, without walking
+    if extensions is None:
+        extensions = TRACKED_EXTENSIONS
+    if rules is None:
+        rules = load_ignore_rules()
+    parts = rel_path.replace(os.sep, "/").split("/")
+    for i in range(1, len(parts) + is_dir):
+        if rules.match("/".join(parts[:i]), True):
+            return False
+    if is_dir:
+        return True
+    verdict = rules.match("/".join(parts), False)
+    return verdict is False or (verdict is None and os.path.splitext(parts[-1])[1].lower() in extensions)
+
 ##################
 # hash
 
-def file_hash(path: Path) -> str | None:
-    # md5 just for easier reading not for security 
+# md5 is only kept so older states can be migrated
+HASH_ALGOS = {
+    "md5": hashlib.md5,
+    "sha256": hashlib.sha256,
+    "blake2b": lambda: hashlib.blake2b(digest_size=32),
+}
+try:
+    import xxhash
+    HASH_ALGOS["xxh3"] = xxhash.xxh3_128
+except ImportError:
+    pass
+
+DEFAULT_HASH_ALGO = "blake2b"
+LEGACY_HASH_ALGO = "md5"
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# one read buffer per thread, reused for every file
+_hash_buffers = threading.local()
+
+def _hash_buffer() -> memoryview:
+    buf = getattr(_hash_buffers, "buf", None)
+    if buf is None:
+        buf = _hash_buffers.buf = memoryview(bytearray(HASH_CHUNK_SIZE))
+    return buf
+
+def file_hash(path: Path, algo: str = DEFAULT_HASH_ALGO, sink=None, limiter=None) -> str | None:
+    # sink gets every chunk as well, so callers can keep the bytes from the same read.
+    # limiter is a TokenBucket, every chunk waits for its budget
     if not path.exists():
         return None
-    return hashlib.md5(path.read_bytes()).hexdigest()
+    h = HASH_ALGOS[algo]()
+    buf = _hash_buffer()
+    start = time.perf_counter()
+    size = 0
+    with open(path, "rb", buffering=0) as f:
+        while n := f.readinto(buf):
+            h.update(buf[:n])
+            size += n
+            if sink is not None:
+                sink.write(buf[:n])
+            if limiter is not None:
+                limiter.take(n)
+    metrics.add_time("hash", time.perf_counter() - start)
+    metrics.count("files_hashed")
+    metrics.count("bytes_read", size)
+    if limiter is not None:
+        # let whatever else wants the cpu run between files
+        time.sleep(0)
+    return h.hexdigest()
 
-def hash_directory(path: Path, extensions: set = None) -> dict[str, str]:
-    if extensions is None:
-        extensions = {'.py', '.js', '.ts', '.mjs', '.cjs', '.json', '.yaml', '.yml', '.sh', '.bat'}
-    
+def write_atomic(path: Path, data: str | bytes):
+    # readers see the old file or the new one, never half of it
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, path)
+
+##################
+# throttle
+# low priority mode for laptops: idle cpu and io class, and a cap on bytes read per second
+
+# MiB/s read by --low-priority when no --read-limit is given
+LOW_PRIORITY_READ_LIMIT = 16
+# ioprio_set has no python binding, syscall numbers per arch
+IOPRIO_SET_SYSCALLS = {"x86_64": 251, "aarch64": 30, "riscv64": 30, "i386": 289, "i686": 289, "armv7l": 314, "ppc64le": 273}
+IOPRIO_CLASS_IDLE = 3
+IOPRIO_CLASS_SHIFT = 13
+
+class TokenBucket:
+    # rate bytes per second with a second worth of burst, so the config and entry files
+    # of an idle watcher go through at once. reads past the budget sleep off the debt
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.tokens = rate
+        self.stamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self, n: int):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            self.tokens -= n
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            metrics.add_time("throttle", wait)
+            time.sleep(wait)
+
+def lower_priority() -> list[str]:
+    # for the whole process, threads started later inherit it. returns what took effect
+    applied = []
+    if hasattr(os, "nice"):
+        try:
+            os.nice(19)
+            applied.append("nice 19")
+        except OSError:
+            pass
+    try:
+        import ctypes
+        import ctypes.util
+        import platform
+        if sys.platform.startswith("linux"):
+            number = IOPRIO_SET_SYSCALLS.get(platform.machine())
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or None, use_errno=True)
+            # IOPRIO_WHO_PROCESS, pid 0 is this process
+            if number and libc.syscall(number, 1, 0, IOPRIO_CLASS_IDLE << IOPRIO_CLASS_SHIFT) == 0:
+                applied.append("io idle")
+        elif sys.platform == "darwin":
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or None)
+            # IOPOL_TYPE_DISK, IOPOL_SCOPE_PROCESS, IOPOL_THROTTLE
+            if libc.setiopolicy_np(0, 0, 3) == 0:
+                applied.append("io throttle")
+        elif sys.platform == "win32":
+            kernel32 = ctypes.windll.kernel32
+            # PROCESS_MODE_BACKGROUND_BEGIN lowers cpu, io and memory priority together
+            if kernel32.SetPriorityClass(kernel32.GetCurrentProcess(), 0x00100000):
+                applied.append("background mode")
+    except (OSError, AttributeError):
+        pass
+    return applied
+
+##################
+# index
+# per server maps of rel path -> digest for big trees. a dict of full path strings to hex
+# strings costs ~250 bytes a file and a check holds several of them (state, old and new
+# stat cache, new hashes, manifest). FileIndex keeps dir prefixes once, names packed in one
+# buffer and digests and stat fields as raw array columns. paths are found through an open
+# addressing table of slot numbers, built on the first lookup, so loading and scanning
+# only append
+
+# servers with fewer files stay plain dicts, they are faster to build and look up
+COMPACT_INDEX_MIN = 20000
+_EMPTY = -1
+_DELETED = -2
+_DEAD_DIR = 0xFFFFFFFF
+_UINT64 = (1 << 64) - 1
+_MISSING = object()
+
+def _signed(ino: int) -> int:
+    # inodes are unsigned 64 bit, kept in a signed column
+    ino &= _UINT64
+    return ino - (1 << 64) if ino >> 63 else ino
+
+class FileIndex(MutableMapping):
+    # values are hex digests or None, with stat set they are hash cache entries
+    # [size, mtime_ns, ino, ctime_ns, digest]. writes take a lock, hashing threads share one
+    __slots__ = (
+        "stat", "_lock", "_dirs", "_dir_ids", "_dir_of", "_names", "_name_ends", "_hashes",
+        "_digests", "_width", "_stats", "_nulls", "_table", "_count", "_fill"
+    )
+
+    def __init__(self, items=(), stat: bool = False):
+        self.stat = stat
+        self._lock = threading.Lock()
+        self._dirs = [""]
+        self._dir_ids = {"": 0}
+        # per slot columns, a deleted slot has _DEAD_DIR until the next rebuild
+        self._dir_of = array("I")
+        self._names = bytearray()
+        self._name_ends = array("I")
+        self._hashes = array("q")
+        self._digests = bytearray()
+        self._width = None
+        self._stats = array("q")
+        self._nulls = set()
+        # None until something is looked up
+        self._table = None
+        self._count = 0
+        # table cells in use, deleted ones included
+        self._fill = 0
+        self.extend(items.items() if isinstance(items, Mapping) else items)
+
+    def _key(self, slot: int) -> str:
+        start = self._name_ends[slot - 1] if slot else 0
+        return self._dirs[self._dir_of[slot]] + self._names[start:self._name_ends[slot]].decode("utf-8", "surrogatepass")
+
+    def _value(self, slot: int):
+        if self._nulls and slot in self._nulls:
+            digest = None
+        else:
+            width = self._width
+            digest = self._digests[slot * width:(slot + 1) * width].hex()
+        if not self.stat:
+            return digest
+        size, mtime_ns, ino, ctime_ns = self._stats[4 * slot:4 * slot + 4]
+        return [size, mtime_ns, ino & _UINT64, ctime_ns, digest]
+
+    def _live(self):
+        if self._count == len(self._dir_of):
+            return range(self._count)
+        dir_of = self._dir_of
+        return (slot for slot in range(len(dir_of)) if dir_of[slot] != _DEAD_DIR)
+
+    def _slot(self, key: str) -> int:
+        # slot of key or -1
+        table = self._table
+        if table is None:
+            with self._lock:
+                if self._table is None:
+                    self._rebuild()
+                table = self._table
+        h = hash(key)
+        mask = len(table) - 1
+        i = h & mask
+        hashes = self._hashes
+        while True:
+            slot = table[i]
+            if slot == _EMPTY:
+                return -1
+            if slot >= 0 and hashes[slot] == h and self._key(slot) == key:
+                return slot
+            i = (i + 1) & mask
+
+    def _cell(self, key: str, h: int) -> tuple[int, int]:
+        # (table cell, slot), slot is -1 when missing and the cell is where it would go
+        table = self._table
+        mask = len(table) - 1
+        i = h & mask
+        free = -1
+        while True:
+            slot = table[i]
+            if slot == _EMPTY:
+                return (free if free >= 0 else i), -1
+            if slot == _DELETED:
+                if free < 0:
+                    free = i
+            elif self._hashes[slot] == h and self._key(slot) == key:
+                return i, slot
+            i = (i + 1) & mask
+
+    def _append(self, key: str, value):
+        # new slot at the end, the caller keeps the table in step
+        cut = key.rfind(os.sep) + 1
+        prefix = key[:cut]
+        dir_id = self._dir_ids.get(prefix)
+        if dir_id is None:
+            dir_id = self._dir_ids[prefix] = len(self._dirs)
+            self._dirs.append(prefix)
+        self._dir_of.append(dir_id)
+        names = self._names
+        names += key[cut:].encode("utf-8", "surrogatepass")
+        self._name_ends.append(len(names))
+        self._hashes.append(hash(key))
+        if self.stat:
+            size, mtime_ns, ino, ctime_ns, digest = value
+            self._stats.extend((size, mtime_ns, _signed(ino), ctime_ns))
+        else:
+            digest = value
+        self._count += 1
+        slot = len(self._hashes) - 1
+        width = self._width
+        if digest is not None and width and len(self._digests) == slot * width:
+            self._digests += bytes.fromhex(digest)
+            if len(self._digests) != (slot + 1) * width:
+                raise ValueError(f"{len(digest) // 2} byte digest in an index of {width} byte digests")
+        else:
+            self._put_digest(slot, digest)
+
+    def _put_digest(self, slot: int, digest: str | None):
+        if digest is None:
+            self._nulls.add(slot)
+            return
+        self._nulls.discard(slot)
+        raw = bytes.fromhex(digest)
+        width = self._width
+        if width is None:
+            width = self._width = len(raw)
+        elif len(raw) != width:
+            raise ValueError(f"{len(raw)} byte digest in an index of {width} byte digests")
+        end = (slot + 1) * width
+        if len(self._digests) < end:
+            # slots before it that only had None get zeros
+            self._digests += bytes(end - width - len(self._digests))
+            self._digests += raw
+        else:
+            self._digests[end - width:end] = raw
+
+    def _rebuild(self):
+        # drops deleted slots and sizes the table for a load under 2/3. appended slots
+        # are not deduplicated, a later one replaces an earlier one with the same path
+        if self._count < len(self._dir_of):
+            self._compact()
+        size = 8
+        while size * 2 <= (self._count + 1) * 3:
+            size *= 2
+        table = array("i", [_EMPTY]) * size
+        mask = size - 1
+        hashes = self._hashes
+        for slot in range(len(hashes)):
+            h = hashes[slot]
+            i = h & mask
+            while True:
+                other = table[i]
+                if other == _EMPTY:
+                    break
+                if hashes[other] == h and self._key(other) == self._key(slot):
+                    self._dir_of[other] = _DEAD_DIR
+                    self._nulls.discard(other)
+                    self._count -= 1
+                    break
+                i = (i + 1) & mask
+            table[i] = slot
+        self._table = table
+        self._fill = self._count
+        if self._count < len(self._dir_of):
+            # repeated paths were dropped, their slots go now too
+            self._rebuild()
+
+    def _compact(self):
+        live = list(self._live())
+        width = self._width or 0
+        ends = self._name_ends
+        names = [self._names[ends[slot - 1] if slot else 0:ends[slot]] for slot in live]
+        self._names = bytearray().join(names)
+        self._name_ends = array("I", itertools.accumulate(map(len, names)))
+        self._nulls = {new for new, old in enumerate(live) if old in self._nulls}
+        self._dir_of = array("I", (self._dir_of[slot] for slot in live))
+        self._hashes = array("q", (self._hashes[slot] for slot in live))
+        self._digests = bytearray().join(self._digests[slot * width:(slot + 1) * width].ljust(width, b"\0") for slot in live)
+        if self.stat:
+            self._stats = array("q", itertools.chain.from_iterable(self._stats[4 * slot:4 * slot + 4] for slot in live))
+
+    def extend(self, items):
+        # bulk append a column at a time, the table is built again on the next lookup
+        pairs = list(items)
+        if not pairs:
+            return
+        keys = [key for key, _ in pairs]
+        values = [value for _, value in pairs]
+        del pairs
+        cuts = [key.rfind(os.sep) + 1 for key in keys]
+        prefixes = [key[:cut] for key, cut in zip(keys, cuts)]
+        names = [key[cut:].encode("utf-8", "surrogatepass") for key, cut in zip(keys, cuts)]
+        if self.stat:
+            stats = array("q", itertools.chain.from_iterable((v[0], v[1], _signed(v[2]), v[3]) for v in values))
+            digests = [v[4] for v in values]
+        else:
+            digests = values
+        with self._lock:
+            for prefix in set(prefixes).difference(self._dir_ids):
+                self._dir_ids[prefix] = len(self._dirs)
+                self._dirs.append(prefix)
+            start = len(self._hashes)
+            self._dir_of.extend(map(self._dir_ids.__getitem__, prefixes))
+            self._name_ends.extend(itertools.islice(itertools.accumulate(map(len, names), initial=len(self._names)), 1, None))
+            self._names += b"".join(names)
+            self._hashes.extend(map(hash, keys))
+            if self.stat:
+                self._stats += stats
+            self._count += len(keys)
+            self._table = None
+            known = next((digest for digest in digests if digest is not None), None)
+            if known is None:
+                self._nulls.update(range(start, start + len(keys)))
+                return
+            if self._width is None:
+                self._put_digest(start + digests.index(known), known)
+            width = self._width
+            filler = "00" * width
+            self._nulls.update(start + i for i, digest in enumerate(digests) if digest is None)
+            raw = bytes.fromhex("".join(filler if digest is None else digest for digest in digests))
+            if len(raw) != len(digests) * width:
+                raise ValueError(f"digests of mixed sizes in an index of {width} byte digests")
+            del self._digests[start * width:]
+            self._digests += bytes(start * width - len(self._digests))
+            self._digests += raw
+
+    def __getitem__(self, key: str):
+        slot = self._slot(key)
+        if slot < 0:
+            raise KeyError(key)
+        return self._value(slot)
+
+    def get(self, key: str, default=None):
+        slot = self._slot(key)
+        return default if slot < 0 else self._value(slot)
+
+    def __contains__(self, key) -> bool:
+        return isinstance(key, str) and self._slot(key) >= 0
+
+    def __setitem__(self, key: str, value):
+        with self._lock:
+            if self._table is None:
+                # nothing looked up yet, the table sorts out repeated paths when it is built
+                self._append(key, value)
+                return
+            h = hash(key)
+            cell, slot = self._cell(key, h)
+            if slot >= 0:
+                if self.stat:
+                    size, mtime_ns, ino, ctime_ns, digest = value
+                    self._stats[4 * slot:4 * slot + 4] = array("q", (size, mtime_ns, _signed(ino), ctime_ns))
+                else:
+                    digest = value
+                self._put_digest(slot, digest)
+                return
+            if (self._fill + 1) * 3 >= len(self._table) * 2:
+                self._rebuild()
+                cell, _ = self._cell(key, h)
+            if self._table[cell] == _EMPTY:
+                self._fill += 1
+            self._table[cell] = len(self._dir_of)
+            self._append(key, value)
+
+    def __delitem__(self, key: str):
+        if self._slot(key) < 0:
+            raise KeyError(key)
+        with self._lock:
+            cell, slot = self._cell(key, hash(key))
+            self._table[cell] = _DELETED
+            self._dir_of[slot] = _DEAD_DIR
+            self._nulls.discard(slot)
+            self._count -= 1
+
+    def _settle(self):
+        # appended paths may repeat until the table is built
+        if self._table is None and self._count:
+            self._slot("")
+
+    def __len__(self) -> int:
+        self._settle()
+        return self._count
+
+    def __iter__(self):
+        self._settle()
+        return (self._key(slot) for slot in self._live())
+
+    def items(self):
+        return _FileIndexItems(self)
+
+    def _twins(self, other: "FileIndex"):
+        # (slot, other's slot or -1) per live slot. paths are matched on the stored hashes
+        # and raw names, nothing is decoded
+        self._settle()
+        other._slot("")
+        dir_map = [other._dir_ids.get(prefix, -1) for prefix in self._dirs]
+        table, hashes, dir_of, names, ends = other._table, other._hashes, other._dir_of, other._names, other._name_ends
+        mask = len(table) - 1
+        for slot in self._live():
+            h = self._hashes[slot]
+            want = dir_map[self._dir_of[slot]]
+            name = self._names[self._name_ends[slot - 1] if slot else 0:self._name_ends[slot]]
+            i = h & mask
+            while True:
+                twin = table[i]
+                if twin == _EMPTY:
+                    twin = -1
+                    break
+                if twin >= 0 and hashes[twin] == h and dir_of[twin] == want and names[ends[twin - 1] if twin else 0:ends[twin]] == name:
+                    break
+                i = (i + 1) & mask
+            yield slot, twin
+
+    def _same_value(self, slot: int, other: "FileIndex", twin: int) -> bool:
+        if self.stat != other.stat or (slot in self._nulls) != (twin in other._nulls):
+            return False
+        if self.stat and self._stats[4 * slot:4 * slot + 4] != other._stats[4 * twin:4 * twin + 4]:
+            return False
+        width = self._width
+        return slot in self._nulls or (width == other._width and self._digests[slot * width:(slot + 1) * width] == other._digests[twin * width:(twin + 1) * width])
+
+    def changes_from(self, old: Mapping) -> tuple[list, list]:
+        # ([(path, value) new or changed since old], [paths gone since old])
+        if not isinstance(old, FileIndex):
+            return [(path, value) for path, value in self.items() if old.get(path, _MISSING) != value], [path for path in old if path not in self]
+        changed = []
+        kept = 0
+        for slot, twin in self._twins(old):
+            if twin < 0 or not self._same_value(slot, old, twin):
+                changed.append((self._key(slot), self._value(slot)))
+            if twin >= 0:
+                kept += 1
+        gone = [] if kept == len(old) else [path for path in old if path not in self]
+        return changed, gone
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Mapping):
+            return NotImplemented
+        if len(self) != len(other):
+            return False
+        if isinstance(other, FileIndex):
+            return not self.changes_from(other)[0]
+        return all(other.get(key, _MISSING) == value for key, value in self.items())
+
+    def __repr__(self) -> str:
+        return f"FileIndex({len(self)} files, {len(self._dirs)} dirs)"
+
+    def copy(self) -> "FileIndex":
+        # column copies, no rehashing
+        self._settle()
+        with self._lock:
+            other = FileIndex(stat=self.stat)
+            other._dirs = list(self._dirs)
+            other._dir_ids = dict(self._dir_ids)
+            for name in ("_dir_of", "_name_ends", "_hashes", "_stats", "_table"):
+                setattr(other, name, array(getattr(self, name).typecode, getattr(self, name)))
+            other._names = bytearray(self._names)
+            other._digests = bytearray(self._digests)
+            other._nulls = set(self._nulls)
+            other._width = self._width
+            other._count = self._count
+            other._fill = self._fill
+        return other
+
+    def group_by_dir(self) -> dict[str, tuple[Mapping, set]]:
+        # same shape as group_by_dir, with each dir's files read from the columns on demand
+        self._settle()
+        slots = {}
+        for slot in self._live():
+            slots.setdefault(self._dir_of[slot], array("I")).append(slot)
+        groups = {"": ({}, set())}
+        for dir_id, dir_slots in slots.items():
+            rel_dir = self._dirs[dir_id][:-1]
+            _register_dir(groups, rel_dir)
+            groups[rel_dir] = (_DirFiles(self, dir_slots), groups[rel_dir][1])
+        return groups
+
+class _FileIndexItems(ItemsView):
+    __slots__ = ()
+
+    def __iter__(self):
+        index = self._mapping
+        index._settle()
+        for slot in index._live():
+            yield index._key(slot), index._value(slot)
+
+class _DirFiles(Mapping):
+    # {file name: value} of one dir of a FileIndex
+    __slots__ = ("_index", "_slots")
+
+    def __init__(self, index: FileIndex, slots: array):
+        self._index = index
+        self._slots = slots
+
+    def _name(self, slot: int) -> str:
+        index = self._index
+        start = index._name_ends[slot - 1] if slot else 0
+        return index._names[start:index._name_ends[slot]].decode("utf-8", "surrogatepass")
+
+    def __getitem__(self, name: str):
+        for slot in self._slots:
+            if self._name(slot) == name:
+                return self._index._value(slot)
+        raise KeyError(name)
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def __iter__(self):
+        return (self._name(slot) for slot in self._slots)
+
+    def items(self):
+        return [(self._name(slot), self._index._value(slot)) for slot in self._slots]
+
+def compact_files(files: dict, stat: bool = False):
+    # a dict past COMPACT_INDEX_MIN becomes a FileIndex, callers keep using the mapping api
+    if type(files) is dict and len(files) >= COMPACT_INDEX_MIN:
+        return FileIndex(files, stat)
+    return files
+
+##################
+# state db
+# sqlite in WAL mode, every save is one transaction touching only changed rows.
+# state.json and hash_cache.json are imported once and renamed to *.migrated
+
+STATE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS files (
+    server TEXT NOT NULL, path TEXT NOT NULL, digest TEXT,
+    PRIMARY KEY (server, path)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS trees (
+    server TEXT NOT NULL, path TEXT NOT NULL, digest TEXT NOT NULL,
+    PRIMARY KEY (server, path)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS hash_cache (
+    server TEXT NOT NULL, path TEXT NOT NULL,
+    size INTEGER, mtime_ns INTEGER, ino INTEGER, ctime_ns INTEGER, digest TEXT,
+    PRIMARY KEY (server, path)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS content_scan (
+    digest TEXT PRIMARY KEY, rules TEXT NOT NULL, findings TEXT NOT NULL
+) WITHOUT ROWID;
+"""
+
+def _migrate_json_state(db: sqlite3.Connection):
+    state_path = get_state_path()
+    if state_path.exists():
+        try:
+            state = json.loads(state_path.read_text())
+        except Exception:
+            # half written by an old version, nothing worth importing
+            state = {}
+        # no hash_algo means md5, check_for_changes migrates that on its own
+        server_hashes = state.pop("server_hashes", {})
+        db.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)", ((k, json.dumps(v)) for k, v in state.items()))
+        db.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?)", (
+            (server, path, digest) for server, files in server_hashes.items() for path, digest in files.items()
+        ))
+        os.replace(state_path, state_path.with_name(state_path.name + ".migrated"))
+
+    cache_path = get_hash_cache_path()
+    if cache_path.exists():
+        try:
+            cache = json.loads(cache_path.read_text())
+            db.execute("INSERT OR REPLACE INTO meta VALUES ('cache_algo', ?)", (json.dumps(cache["algo"]),))
+            db.executemany("INSERT OR REPLACE INTO hash_cache VALUES (?, ?, ?, ?, ?, ?, ?)", (
+                (server, path, *entry) for server, files in cache["servers"].items() for path, entry in files.items()
+            ))
+        except Exception:
+            pass
+        os.replace(cache_path, cache_path.with_name(cache_path.name + ".migrated"))
+
+@contextmanager
+def state_db():
+    # one transaction, committed on exit, rolled back on error
+    db_path = get_state_db_path()
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    db = sqlite3.connect(db_path, timeout=30)
+    try:
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        with db:
+            db.executescript(STATE_SCHEMA)
+            if get_state_path().exists() or get_hash_cache_path().exists():
+                _migrate_json_state(db)
+        with db:
+            yield db
+    finally:
+        db.close()
+
+def get_state_meta(key: str, default=None):
+    with state_db() as db:
+        row = db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return json.loads(row[0]) if row else default
+
+def set_state_meta(key: str, value):
+    with state_db() as db:
+        db.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, json.dumps(value)))
+
+def _load_rows(db: sqlite3.Connection, table: str, columns: str, compact: bool = False) -> dict[str, dict]:
+    # with compact set, servers past COMPACT_INDEX_MIN rows are loaded into a FileIndex
+    result = {}
+    cursor = db.execute(f"SELECT server, path, {columns} FROM {table}")
+    while rows := cursor.fetchmany(4096):
+        for server, group in itertools.groupby(rows, key=lambda row: row[0]):
+            files = result.setdefault(server, {})
+            pairs = ((row[1], row[2] if len(row) == 3 else list(row[2:])) for row in group)
+            if isinstance(files, FileIndex):
+                files.extend(pairs)
+            else:
+                files.update(pairs)
+                if compact and len(files) >= COMPACT_INDEX_MIN:
+                    result[server] = FileIndex(files, stat=len(rows[0]) > 3)
+    return result
+
+def _load_selected_rows(db: sqlite3.Connection, table: str, columns: str, wanted: dict[str, list[str]]) -> dict[str, dict]:
+    # only the (server, path) rows asked for, one primary key lookup each
+    result = {}
+    for server, paths in wanted.items():
+        files = result.setdefault(server, {})
+        for path in paths:
+            row = db.execute(f"SELECT {columns} FROM {table} WHERE server = ? AND path = ?", (server, path)).fetchone()
+            if row:
+                files[path] = row[0] if len(row) == 1 else list(row)
+    return result
+
+def _save_rows(db: sqlite3.Connection, table: str, new: dict[str, dict], old: dict[str, dict] | None):
+    # old is what the table holds now, only the rows that differ are written
+    if old is None:
+        db.execute(f"DELETE FROM {table}")
+        old = {}
+    width = None
+    upserts = []
+    deletes = []
+    for server in old.keys() | new.keys():
+        old_files = old.get(server, {})
+        new_files = new.get(server, {})
+        if old_files is new_files:
+            continue
+        if isinstance(new_files, FileIndex):
+            changed, gone = new_files.changes_from(old_files)
+        else:
+            changed = [(path, value) for path, value in new_files.items() if old_files.get(path, _MISSING) != value]
+            gone = [path for path in old_files if path not in new_files]
+        for path, value in changed:
+            row = (server, path, *(value if isinstance(value, list) else [value]))
+            width = len(row)
+            upserts.append(row)
+        deletes.extend((server, path) for path in gone)
+    if deletes:
+        db.executemany(f"DELETE FROM {table} WHERE server = ? AND path = ?", deletes)
+    if upserts:
+        db.executemany(f"INSERT OR REPLACE INTO {table} VALUES ({', '.join('?' * width)})", upserts)
+
+##################
+# hash cache
+# per file stat metadata so unchanged files are not read again
+
+# files modified this close to the check are not cached, a same size write
+# inside the mtime granularity would otherwise look unchanged next time
+RACY_WINDOW_NS = 2_000_000_000
+
+def load_hash_cache(algo: str) -> dict:
+    with state_db() as db:
+        row = db.execute("SELECT value FROM meta WHERE key = 'cache_algo'").fetchone()
+        # digests from another algo are useless
+        if not row or json.loads(row[0]) != algo:
+            return {}
+        return _load_rows(db, "hash_cache", "size, mtime_ns, ino, ctime_ns, digest", compact=True)
+
+def save_hash_cache(cache: dict, algo: str, previous: dict = None):
+    # previous is what load_hash_cache returned, so only changed entries are written
+    with state_db() as db:
+        row = db.execute("SELECT value FROM meta WHERE key = 'cache_algo'").fetchone()
+        if not row or json.loads(row[0]) != algo:
+            previous = None
+        db.execute("INSERT OR REPLACE INTO meta VALUES ('cache_algo', ?)", (json.dumps(algo),))
+        _save_rows(db, "hash_cache", cache, previous)
+
+def stat_key(st: os.stat_result) -> list:
+    return [st.st_size, st.st_mtime_ns, st.st_ino, st.st_ctime_ns]
+
+def cached_file_hash(path: Path, rel_path: str, old_cache: dict, new_cache: dict, paranoid: bool = False, algo: str = DEFAULT_HASH_ALGO, st: os.stat_result = None, sink=None, limiter=None) -> str | None:
+    try:
+        if st is None:
+            st = path.stat()
+    except OSError:
+        return None
+    key = stat_key(st)
+    entry = old_cache.get(rel_path)
+    if not paranoid and entry and entry[:4] == key:
+        new_cache[rel_path] = entry
+        metrics.count("cache_hits")
+        return entry[4]
+
+    h = file_hash(path, algo, sink, limiter)
+    if h and time.time_ns() - st.st_mtime_ns > RACY_WINDOW_NS:
+        new_cache[rel_path] = key + [h]
+    return h
+
+##################
+# scan
+# one read per file feeds both the digest and the snapshot
+
+# files up to this size are kept in memory for the snapshot, bigger ones spill to a temp file
+SNAPSHOT_SPOOL_SIZE = 4 * 1024 * 1024
+
+@dataclass
+class ScanOptions:
+    paranoid: bool = False
+    algo: str = DEFAULT_HASH_ALGO
+    jobs: int = 1
+    rules: IgnoreRules = None
+    generations: int = None
+    # fleet mode shares server trees between profiles through this, see shared_tree_key
+    shared: dict = None
+    # low priority mode, reads are paced and entry files go first
+    throttle: TokenBucket = None
+    # added and modified files are scanned for suspicious content, see scan_changed_content
+    content_scan: bool = True
+
+    def __post_init__(self):
+        if self.rules is None:
+            self.rules = load_ignore_rules()
+        if self.generations is None:
+            self.generations = HISTORY_GENERATIONS
+
+def scan_file(path: Path, rel_path: str, st: os.stat_result, old_cache: dict, new_cache: dict, options: ScanOptions, previous: dict = None) -> str | None:
+    # previous is the server manifest, digests not in it are put in the object store
+    if previous is None:
+        return cached_file_hash(path, rel_path, old_cache, new_cache, options.paranoid, options.algo, st, limiter=options.throttle)
+
+    with tempfile.SpooledTemporaryFile(SNAPSHOT_SPOOL_SIZE) as spool:
+        h = cached_file_hash(path, rel_path, old_cache, new_cache, options.paranoid, options.algo, st, spool, options.throttle)
+        if h is None or h == previous.get(rel_path):
+            return h
+        # the previous version is the delta base
+        base = previous.get(rel_path)
+        if spool.tell() == 0 and st.st_size:
+            # stat cache hit, the file was never read. it is now, and only kept if it still matches
+            snapshot_verified(path, h, base, options)
+        else:
+            try:
+                spool.seek(0)
+                put_object(h, spool, base)
+            except Exception:
+                # reverts depend on these, a failure shows up in metrics.ndjson
+                metrics.count("snapshot_errors")
+    return h
+
+def snapshot_verified(path: Path, h: str, base: str | None, options: ScanOptions):
+    # hashes while copying into a spool, so the object stored is exactly what digests to h
+    with tempfile.SpooledTemporaryFile(SNAPSHOT_SPOOL_SIZE) as spool:
+        try:
+            if file_hash(path, options.algo, spool, options.throttle) != h:
+                # changed since the stat, the next check sees the new version
+                metrics.count("snapshot_stale")
+                return
+            spool.seek(0)
+            put_object(h, spool, base)
+        except Exception:
+            metrics.count("snapshot_errors")
+
+# what a server starts from, checked first by the quick phase and when throttled
+ENTRY_FILES = ("package.json", "index.js", "index.mjs", "index.cjs", "index.ts", "main.py", "server.py", "__main__.py", "__init__.py")
+
+def entry_candidates(root: Path, extensions: set = None, rules: IgnoreRules = None) -> list[str]:
+    # the usual entry names plus whatever package.json main and bin point at, tracked or not on disk
+    candidates = list(ENTRY_FILES)
+    package = _read_json(root / "package.json")
+    targets = [package.get("main")]
+    targets += list(package["bin"].values()) if isinstance(package.get("bin"), dict) else [package.get("bin")]
+    for target in targets:
+        if isinstance(target, str):
+            rel_path = os.path.normpath(target)
+            if not rel_path.startswith("..") and not os.path.isabs(rel_path):
+                candidates.append(rel_path)
+    return [rel_path for rel_path in dict.fromkeys(candidates) if is_tracked(rel_path, extensions, rules)]
+
+def entry_files(root: Path, extensions: set = None, rules: IgnoreRules = None) -> list[str]:
+    return [rel_path for rel_path in entry_candidates(root, extensions, rules) if (root / rel_path).is_file()]
+
+##################
+# pool
+# hashlib drops the GIL while digesting so threads overlap hashing and I/O
+
+# in-flight jobs per worker, keeps memory flat on huge trees
+POOL_QUEUE_FACTOR = 4
+
+def bounded_map(pool: ThreadPoolExecutor | None, fn, jobs, window: int):
+    # like pool.map but lazy over jobs and in submission order
+    if pool is None:
+        for job in jobs:
+            yield fn(*job)
+        return
+    pending = deque()
+    for job in jobs:
+        pending.append(pool.submit(fn, *job))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+def hash_directory(path: Path, extensions: set = None, old_cache: dict = None, new_cache: dict = None, options: ScanOptions = None, pool: ThreadPoolExecutor = None, previous: dict = None) -> dict[str, str]:
+    # with previous set, changed files are snapshotted from the hashing read
     hashes = {}
     if not path.exists():
         return hashes
+    if options is None:
+        options = ScanOptions()
+
+    # new_cache is rebuilt from scratch so deleted files drop out
+    if old_cache is None:
+        old_cache = {}
+    if new_cache is None:
+        new_cache = {}
     
+    def hash_one(rel_path, entry):
+        try:
+            st = entry.stat()
+        except OSError:
+            return rel_path, None
+        return rel_path, scan_file(Path(entry.path), rel_path, st, old_cache, new_cache, options, previous)
+
     try:
-        for file in path.rglob('*'):
-            if file.is_file() and file.suffix.lower() in extensions:
-                if any(skip in file.parts for skip in ['node_modules', '__pycache__', '.git', 'venv', '.venv']):
+        jobs = walk_files(path, extensions, options.rules)
+        if options.throttle is not None:
+            # entry files first, the deep tree after them
+            for rel_path in entry_files(path, extensions, options.rules):
+                try:
+                    st = (path / rel_path).stat()
+                except OSError:
                     continue
-                rel_path = str(file.relative_to(path))
-                hashes[rel_path] = file_hash(file)
+                hashes[rel_path] = scan_file(path / rel_path, rel_path, st, old_cache, new_cache, options, previous)
+            jobs = ((rel_path, entry) for rel_path, entry in jobs if rel_path not in hashes)
+        for rel_path, h in bounded_map(pool, hash_one, jobs, options.jobs * POOL_QUEUE_FACTOR):
+            hashes[rel_path] = h
+            if len(hashes) == COMPACT_INDEX_MIN:
+                hashes = compact_files(hashes)
     except Exception:
         pass
     
     return hashes
 
-def get_server_paths(config_path: Path) -> dict[str, Path]:
+##################
+# config model
+# the config is parsed once per digest, every caller shares the result
+
+SERVER_INTERPRETERS = ("python", "python3", "py", "node", "npx", "npm", "uvx", "uv")
+# parsed configs kept around, the current one and whatever the last check compared against
+CONFIG_CACHE_SIZE = 4
+# env values are usually tokens, diffs only say that they changed
+REDACTED = "<redacted>"
+
+def resolve_server_path(server_config: dict) -> Path | None:
     # check cmd for path otherwise use args
-    servers = {}
-    if not config_path.exists():
-        return servers
-    
+    command = server_config.get("command", "")
+    args = server_config.get("args", [])
+    if command.lower() in SERVER_INTERPRETERS or command.lower().endswith(SERVER_INTERPRETERS):
+        for arg in args:
+            if not isinstance(arg, str) or arg.startswith("-"):
+                continue
+            potential_path = Path(arg).expanduser()
+            if potential_path.exists():
+                return potential_path
+        return None
+    potential_path = Path(command).expanduser()
+    return potential_path if potential_path.exists() else None
+
+class ConfigModel:
+    def __init__(self, digest: str | None, data: bytes | None):
+        self.digest = digest
+        self.error = None
+        self.servers = {}
+        # name -> {"path", "is_file"} plus "package" and "source" for npx/uvx servers, None until found on disk
+        self._paths = {}
+        self._fields = None
+        # package lookups, loaded from state on first use, and when a miss may be retried
+        self._packages = None
+        self._package_retry = {}
+        # npx/uvx servers of a fleet profile whose home is unknown, left unchecked
+        self.unresolved = set()
+        if data is None:
+            return
+        try:
+            servers = json.loads(data).get("mcpServers", {}) or {}
+            if not isinstance(servers, dict):
+                raise ValueError("mcpServers is not an object")
+            self.servers = servers
+        except Exception as e:
+            self.error = f"{e}"
+        self._paths = {name: None for name in self.servers}
+
+    @property
+    def fields(self) -> dict[str, dict]:
+        if self._fields is None:
+            self._fields = {name: config_fields(server_config) for name, server_config in self.servers.items()}
+        return self._fields
+
+    @property
+    def summary(self) -> str:
+        if self.digest is None:
+            return "no config"
+        if self.error:
+            return self.error
+        if not self.servers:
+            return "no MCPS configured"
+        return f"{len(self.servers)} server(s): {', '.join(self.servers.keys())}"
+
+    def server_paths(self) -> dict[str, dict]:
+        # found paths are kept, missing ones are probed again since they may get installed later.
+        # npx/uvx servers are looked up in the package caches instead of their args, which
+        # usually name the data they work on
+        found = False
+        now = time.monotonic()
+        for name, info in self._paths.items():
+            server_config = self.servers[name]
+            if info is not None or not isinstance(server_config, dict):
+                continue
+            spec = package_spec(server_config)
+            if spec is None:
+                server_path = resolve_server_path(server_config)
+                if server_path:
+                    self._paths[name] = {"path": server_path, "is_file": server_path.is_file()}
+                continue
+            home = get_profile_home()
+            if home is None:
+                self.unresolved.add(name)
+                continue
+            if self._packages is None:
+                self._packages = load_package_memo(self.digest, home)
+            package = self._packages.get(name)
+            if package is None or not os.path.exists(package["path"]):
+                if now < self._package_retry.get(name, 0):
+                    continue
+                package = resolve_package(spec, home)
+                if package is None:
+                    self._package_retry[name] = now + PACKAGE_RETRY_INTERVAL
+                    continue
+                self._packages[name] = package
+                found = True
+            self._paths[name] = {"path": Path(package["path"]), "is_file": False, "package": package["package"], "source": package["source"]}
+        if found:
+            save_package_memo(self.digest, get_profile_home(), self._packages)
+        return {name: info for name, info in self._paths.items() if info is not None}
+
+_config_models = {}
+_config_lock = threading.Lock()
+
+def load_config(config_path: Path) -> ConfigModel:
+    # reading a few KB is cheap, parsing and probing every arg is what gets skipped
     try:
-        config = json.loads(config_path.read_text())
-        mcp_servers = config.get("mcpServers", {})
-        
-        for name, server_config in mcp_servers.items():
-            command = server_config.get("command", "")
-            args = server_config.get("args", [])
-            
-            server_path = None
-            
-            interpreters = ("python", "python3", "py", "node", "npx", "npm", "uvx", "uv")
-            
-            if command.lower() in interpreters or command.lower().endswith(interpreters):
-                for arg in args:
-                    if arg.startswith("-"):
-                        continue
-                    potential_path = Path(arg).expanduser()
-                    if potential_path.exists():
-                        server_path = potential_path
-                        break
-            else:
-                potential_path = Path(command).expanduser()
-                if potential_path.exists():
-                    server_path = potential_path
-            
-            if server_path:
-                servers[name] = {
-                    "path": server_path,
-                    "is_file": server_path.is_file()
-                }
-    except Exception:
-        pass
-    
-    return servers
+        data = config_path.read_bytes()
+    except OSError:
+        return ConfigModel(None, None)
+    digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+    key = (str(config_path), digest)
+    with _config_lock:
+        model = _config_models.pop(key, None)
+        if model is None:
+            with metrics.phase("config_parse"):
+                model = ConfigModel(digest, data)
+        # most recently used last
+        _config_models[key] = model
+        while len(_config_models) > CONFIG_CACHE_SIZE:
+            del _config_models[next(iter(_config_models))]
+    return model
 
-def hash_all_servers(config_path: Path) -> dict[str, dict[str, str]]:
-    server_info = get_server_paths(config_path)
-    all_hashes = {}
-    
-    for name, info in server_info.items():
-        path = info["path"]
-        is_file = info["is_file"]
-        
-        if is_file:
-            h = file_hash(path)
-            if h:
-                all_hashes[name] = {path.name: h}
+def get_server_paths(config_path: Path) -> dict[str, dict]:
+    return load_config(config_path).server_paths()
+
+def config_fields(server_config) -> dict:
+    # one level of nesting flattened (env.KEY, ...). env values are replaced by a
+    # digest, so they can be compared and stored without keeping the secret
+    if not isinstance(server_config, dict):
+        return {"": server_config}
+    fields = {}
+    for key, value in server_config.items():
+        if isinstance(value, dict):
+            for sub_key, sub_value in value.items():
+                if key == "env":
+                    sub_value = hashlib.blake2b(json.dumps(sub_value).encode(), digest_size=8).hexdigest()
+                fields[f"{key}.{sub_key}"] = sub_value
         else:
-            all_hashes[name] = hash_directory(path)
-    
-    return all_hashes
+            fields[key] = value
+    return fields
 
-def compare_server_hashes(old: dict, new: dict) -> dict[str, dict[str, list]]:
-    changes = {}
-    all_servers = set(old.keys()) | set(new.keys())
+def _shown(field: str, value):
+    return REDACTED if field.startswith("env.") and value is not None else value
 
-    for server in all_servers:
-        old_files = old.get(server, {})
-        new_files = new.get(server, {})
-        
-        added = [f for f in new_files if f not in old_files]
-        removed = [f for f in old_files if f not in new_files]
-        modified = [f for f in old_files if f in new_files and old_files[f] != new_files[f]]
-        
-        if added or removed or modified:
-            changes[server] = {
-                "added": added,
-                "removed": removed,
-                "modified": modified
-            }
-    
-    return changes
+def diff_config_servers(old: dict[str, dict], new: dict[str, dict]) -> dict:
+    # takes config_fields per server. mcpServers entries added, removed and edited,
+    # edits are [field, old, new] with None for a missing field
+    edited = {}
+    for name in sorted(old.keys() & new.keys()):
+        changes = [
+            [field, _shown(field, old[name].get(field)), _shown(field, new[name].get(field))]
+            for field in sorted(old[name].keys() | new[name].keys())
+            if old[name].get(field) != new[name].get(field)
+        ]
+        if changes:
+            edited[name] = changes
+    return {
+        "added": {name: {field: _shown(field, value) for field, value in new[name].items()} for name in sorted(new.keys() - old.keys())},
+        "removed": sorted(old.keys() - new.keys()),
+        "edited": edited
+    }
 
 ##################
-# states
+# package resolvers
+# npx and uvx servers run out of the package manager caches, not from a path in the
+# config. the lookups list cache dirs, so what they find is remembered per config digest
 
-def save_file_snapshot(server_name: str, file_path: str, content: str):
-    snapshots_dir = get_snapshots_path()
-    snapshots_dir.mkdir(parents=True, exist_ok=True)
-    safe_name = f"{server_name}_{file_path.replace('/', '_').replace(os.sep, '_')}"
-    snapshot_file = snapshots_dir / f"{safe_name}.snapshot"
-    snapshot_file.write_text(content, encoding='utf-8', errors='replace')
+PACKAGE_MANAGERS = ("npx", "uvx")
+# a package not in the caches yet (first run of the server) is looked for again after this
+PACKAGE_RETRY_INTERVAL = 300.0
+# npx options that take a value, the package is the first other argument
+NPX_VALUE_OPTIONS = {"-p", "--package", "--registry", "--cache", "--prefix", "--userconfig", "--node-options"}
+UVX_VALUE_OPTIONS = {
+    "--from", "--with", "--with-editable", "--with-requirements", "-p", "--python", "--index", "--index-url",
+    "--default-index", "--extra-index-url", "-f", "--find-links", "-c", "--constraints", "--overrides",
+    "--directory", "--project", "--cache-dir", "--config-file"
+}
+NPM_SPEC_RE = re.compile(r"((?:@[^/@\s]+/)?[^/@\s]+)(?:@(\S+))?")
+PYPI_SPEC_RE = re.compile(r"([A-Za-z0-9][A-Za-z0-9._-]*)(?:\[[^\]]*\])?\s*(?:(?:@|==)\s*([\w.+!-]+))?")
+EXACT_VERSION_RE = re.compile(r"v?\d+(\.\d+)*([.+-]?\w+)*")
 
-def get_file_snapshot(server_name: str, file_path: str) -> str | None:
-    snapshots_dir = get_snapshots_path()
-    safe_name = f"{server_name}_{file_path.replace('/', '_').replace(os.sep, '_')}"
-    snapshot_file = snapshots_dir / f"{safe_name}.snapshot"
-    if snapshot_file.exists():
-        return snapshot_file.read_text(encoding='utf-8', errors='replace')
-    return None
+# all of these take the profile's home, the env overrides only count for your own profile
 
-def save_all_snapshots(config_path: Path):
-    server_info = get_server_paths(config_path)
-    extensions = {'.py', '.js', '.ts', '.mjs', '.cjs', '.json', '.yaml', '.yml', '.sh', '.bat'}
-    
-    for server_name, info in server_info.items():
-        path = info["path"]
-        is_file = info["is_file"]
-        
-        if is_file:
-            try:
-                content = path.read_text(encoding='utf-8', errors='replace')
-                save_file_snapshot(server_name, path.name, content)
-            except Exception:
-                pass
-        else:
-            if not path.exists():
-                continue
-            try:
-                for file in path.rglob('*'):
-                    if file.is_file() and file.suffix.lower() in extensions:
-                        if any(skip in file.parts for skip in ['node_modules', '__pycache__', '.git', 'venv', '.venv']):
-                            continue
-                        rel_path = str(file.relative_to(path))
-                        content = file.read_text(encoding='utf-8', errors='replace')
-                        save_file_snapshot(server_name, rel_path, content)
-            except Exception:
-                pass
+def get_npm_cache_path(home: Path) -> Path:
+    if get_user_env("npm_config_cache"):
+        return Path(get_user_env("npm_config_cache"))
+    if sys.platform == "win32":
+        return Path(get_user_env("LOCALAPPDATA") or home / "AppData" / "Local") / "npm-cache"
+    return home / ".npm"
 
-def load_state() -> dict:
-    state_path = get_state_path()
-    if state_path.exists():
-        return json.loads(state_path.read_text())
-    return {}
+def get_npm_global_paths(home: Path) -> list[Path]:
+    paths = []
+    prefix = get_user_env("npm_config_prefix") or get_user_env("NPM_CONFIG_PREFIX")
+    if prefix:
+        paths += [Path(prefix) / "lib" / "node_modules", Path(prefix) / "node_modules"]
+    if sys.platform == "win32":
+        paths.append(Path(get_user_env("APPDATA") or home / "AppData" / "Roaming") / "npm" / "node_modules")
+    else:
+        paths += [Path("/usr/local/lib/node_modules"), Path("/opt/homebrew/lib/node_modules"), Path("/usr/lib/node_modules")]
+    return paths
 
-def save_state(state: dict):
-    state_path = get_state_path()
-    state_path.parent.mkdir(parents=True, exist_ok=True)
-    state_path.write_text(json.dumps(state, indent=2))
+def get_uv_cache_path(home: Path) -> Path:
+    if get_user_env("UV_CACHE_DIR"):
+        return Path(get_user_env("UV_CACHE_DIR"))
+    if sys.platform == "win32":
+        return Path(get_user_env("LOCALAPPDATA") or home / "AppData" / "Local") / "uv" / "cache"
+    return Path(get_user_env("XDG_CACHE_HOME") or home / ".cache") / "uv"
 
-###################
+def get_uv_tools_path(home: Path) -> Path:
+    if get_user_env("UV_TOOL_DIR"):
+        return Path(get_user_env("UV_TOOL_DIR"))
+    if sys.platform == "win32":
+        return Path(get_user_env("APPDATA") or home / "AppData" / "Roaming") / "uv" / "tools"
+    return Path(get_user_env("XDG_DATA_HOME") or home / ".local" / "share") / "uv" / "tools"
 
-def get_config_summary(path: Path) -> str:
-    if not path.exists():
-        return "no config"
-    try:
-        config = json.loads(path.read_text())
-        servers = config.get("mcpServers", {})
-        if not servers:
-            return "no MCPS configured"
-        return f"{len(servers)} server(s): {', '.join(servers.keys())}"
-    except Exception as e:
-        return f"{e}"
+def _first_package_arg(args: list, value_options: set, from_option: str) -> str | None:
+    args = iter(args)
+    for arg in args:
+        if not isinstance(arg, str):
+            return None
+        if arg == from_option:
+            return next(args, None)
+        if arg.startswith(from_option + "="):
+            return arg.split("=", 1)[1]
+        if arg in value_options:
+            next(args, None)
+        elif arg in ("-c", "--call"):
+            # npx -c runs a shell string, there is no package to find
+            return None
+        elif not arg.startswith("-"):
+            return arg
+    return None
 
-####################
+def package_spec(server_config: dict) -> tuple[str, str, str | None] | None:
+    # (manager, name, version or None) for servers started through npx or uvx.
+    # local paths and urls are left to resolve_server_path
+    command = Path(str(server_config.get("command", ""))).name.lower()
+    command = command[:-4] if command.endswith((".cmd", ".exe")) else command
+    args = server_config.get("args", []) or []
+    if command == "uv" and args[:2] == ["tool", "run"]:
+        command, args = "uvx", args[2:]
+    if command not in PACKAGE_MANAGERS:
+        return None
+    if command == "npx":
+        spec = _first_package_arg(args, NPX_VALUE_OPTIONS, "--package")
+    else:
+        spec = _first_package_arg(args, UVX_VALUE_OPTIONS, "--from")
+    if not spec or spec.startswith((".", "/", "~", "\\")) or ":" in spec:
+        return None
+    match = (NPM_SPEC_RE if command == "npx" else PYPI_SPEC_RE).fullmatch(spec)
+    if not match:
+        return None
+    return command, match.group(1), match.group(2)
+
+def _wanted(version: str | None, wanted: str | None) -> bool:
+    # ranges and tags (latest, ^1.2) take whatever is installed, exact pins must match
+    if not wanted or not EXACT_VERSION_RE.fullmatch(wanted):
+        return True
+    return version == wanted.lstrip("v")
+
+def _read_json(path: Path) -> dict:
+    try:
+        with open(path, "rb") as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+def resolve_npx(name: str, wanted: str | None, home: Path) -> dict | None:
+    # npx installs every package set into _npx/<hash>/node_modules, the lockfile next
+    # to it pins what was installed. the newest matching install is the one npx runs
+    best = None
+    try:
+        entries = list(os.scandir(get_npm_cache_path(home) / "_npx"))
+    except OSError:
+        entries = []
+    for entry in entries:
+        package_dir = Path(entry.path) / "node_modules" / name
+        try:
+            mtime = (package_dir / "package.json").stat().st_mtime_ns
+        except OSError:
+            continue
+        lock = _read_json(Path(entry.path) / "package-lock.json")
+        version = lock.get("packages", {}).get(f"node_modules/{name}", {}).get("version")
+        version = version or _read_json(package_dir / "package.json").get("version")
+        if _wanted(version, wanted) and (best is None or mtime > best[0]):
+            best = (mtime, package_dir, version)
+    if best:
+        return {"path": str(best[1]), "package": f"{name}@{best[2]}", "source": "npx"}
+    # npx runs a globally installed package before downloading one
+    for root in get_npm_global_paths(home):
+        version = _read_json(root / name / "package.json").get("version")
+        if version and _wanted(version, wanted):
+            return {"path": str(root / name), "package": f"{name}@{version}", "source": "npm-global"}
+    return None
+
+def _normalize_dist(name: str) -> str:
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+def _dist_version(directory: Path, name: str) -> str | None:
+    # version from the <name>-<version>.dist-info dir of a wheel
+    try:
+        entries = os.listdir(directory)
+    except OSError:
+        return None
+    for entry in entries:
+        if entry.endswith(".dist-info") and "-" in entry:
+            dist, version = entry[:-len(".dist-info")].rsplit("-", 1)
+            if _normalize_dist(dist) == name:
+                return version
+    return None
+
+def _site_packages(env: Path) -> Path | None:
+    for candidate in [*env.glob("lib/python*/site-packages"), env / "Lib" / "site-packages"]:
+        if candidate.is_dir():
+            return candidate
+    return None
+
+def resolve_uvx(name: str, wanted: str | None, home: Path) -> dict | None:
+    # an installed tool (uv tool install) wins unless another version is asked for,
+    # otherwise uvx runs from the unpacked wheel in the cache archive
+    name = _normalize_dist(name)
+    site_packages = _site_packages(get_uv_tools_path(home) / name)
+    if site_packages:
+        version = _dist_version(site_packages, name)
+        if version and _wanted(version, wanted):
+            return {"path": str(site_packages), "package": f"{name}=={version}", "source": "uv-tool"}
+    best = None
+    try:
+        entries = list(os.scandir(get_uv_cache_path(home) / "archive-v0"))
+    except OSError:
+        entries = []
+    for entry in entries:
+        version = _dist_version(Path(entry.path), name)
+        if version is None or not _wanted(version, wanted):
+            continue
+        try:
+            mtime = entry.stat().st_mtime_ns
+        except OSError:
+            continue
+        if best is None or mtime > best[0]:
+            best = (mtime, entry.path, version)
+    if best:
+        return {"path": best[1], "package": f"{name}=={best[2]}", "source": "uvx"}
+    return None
+
+def resolve_package(spec: tuple[str, str, str | None], home: Path) -> dict | None:
+    manager, name, wanted = spec
+    with metrics.phase("package_resolve"):
+        return resolve_npx(name, wanted, home) if manager == "npx" else resolve_uvx(name, wanted, home)
+
+def load_package_memo(digest: str | None, home: Path) -> dict[str, dict]:
+    # what the last run found for this exact config and home, a changed config starts over
+    try:
+        memo = get_state_meta("package_paths")
+    except sqlite3.Error:
+        return {}
+    if not memo or memo.get("config") != digest or memo.get("home") != str(home):
+        return {}
+    return memo.get("servers", {})
+
+def save_package_memo(digest: str | None, home: Path, packages: dict[str, dict]):
+    try:
+        set_state_meta("package_paths", {"config": digest, "home": str(home), "servers": packages})
+    except sqlite3.Error:
+        pass
+
+def shared_tree_key(info: dict, options: ScanOptions) -> tuple:
+    # same tree hashed the same way gives the same result, whichever profile asks
+    try:
+        path = info["path"].resolve()
+    except OSError:
+        path = info["path"]
+    return str(path), info["is_file"], options.algo, options.paranoid, options.rules.key()
+
+def snapshot_shared(info: dict, hashes: dict[str, str], manifest: dict, options: ScanOptions):
+    # a shared result skipped this profile's scan_file, so its object store may lack
+    # the new versions. only those files are read again, and kept only if they still match
+    root = info["path"]
+    for rel_path, h in hashes.items():
+        if h is None or h == manifest.get(rel_path) or has_object(h):
+            continue
+        snapshot_verified(root if info["is_file"] else root / rel_path, h, manifest.get(rel_path), options)
+
+def hash_all_servers(config_path: Path, options: ScanOptions = None, snapshot: bool = False) -> dict[str, dict[str, str]]:
+    # with snapshot set, new content goes to the object store and manifests are updated
+    with metrics.phase("get_server_paths"):
+        server_info = get_server_paths(config_path)
+    if options is None:
+        options = ScanOptions()
+    all_hashes = {}
+    with metrics.phase("load_hash_cache"):
+        cache = load_hash_cache(options.algo)
+    new_cache = {}
+    jobs = options.jobs
+
+    # one pool walks servers, the other hashes files, so a server
+    # waiting on its files never starves the file workers
+    file_pool = ThreadPoolExecutor(max_workers=jobs) if jobs > 1 else None
+    server_pool = ThreadPoolExecutor(max_workers=min(jobs, len(server_info))) if file_pool and server_info else None
+
+    def hash_server(name, info):
+        path = info["path"]
+        # a server that was big last time gets a compact cache from the start, workers write it
+        server_cache = new_cache[name] = FileIndex(stat=True) if isinstance(cache.get(name), FileIndex) else {}
+        manifest = load_manifest(name) if snapshot else None
+        key = shared_tree_key(info, options) if options.shared is not None else None
+        if key in (options.shared or {}):
+            # another profile already hashed this tree in this run
+            hashes, entries = options.shared[key]
+            server_cache.update(entries)
+            metrics.count("shared_trees")
+            if snapshot and hashes:
+                snapshot_shared(info, hashes, manifest, options)
+        elif info["is_file"]:
+            try:
+                st = path.stat()
+            except OSError:
+                return name, None
+            h = scan_file(path, path.name, st, cache.get(name, {}), server_cache, options, manifest)
+            hashes = {path.name: h} if h else None
+        else:
+            hashes = hash_directory(path, old_cache=cache.get(name, {}), new_cache=server_cache, options=options, pool=file_pool, previous=manifest)
+        if key is not None and key not in options.shared:
+            options.shared[key] = (hashes, server_cache.copy())
+        if snapshot and hashes is not None and hashes != manifest:
+            update_history(name, manifest, hashes, options.generations)
+            save_manifest(name, hashes)
+        return name, hashes
+
+    try:
+        servers = server_info.items()
+        if options.throttle is not None:
+            # single file servers are quick, they go before the trees
+            servers = sorted(servers, key=lambda item: not item[1]["is_file"])
+        for name, hashes in bounded_map(server_pool, hash_server, servers, len(server_info) or 1):
+            if hashes is not None:
+                all_hashes[name] = hashes
+    finally:
+        for pool in (server_pool, file_pool):
+            if pool:
+                pool.shutdown()
+    
+    with metrics.phase("save_hash_cache"):
+        save_hash_cache(new_cache, options.algo, previous=cache)
+    return all_hashes
+
+def rehash_touched(config_path: Path, options: ScanOptions, base: dict, touched: dict[str, set[str]]) -> dict[str, dict[str, str]]:
+    # base is the last full result, only the touched paths of each server are hashed again.
+    # a touched dir is rescanned below it, "" stands for the whole server
+    server_info = get_server_paths(config_path)
+    old_caches = load_hash_cache(options.algo)
+    cache = dict(old_caches)
+    all_hashes = {name: base[name] for name in server_info if name in base}
+
+    for name, rel_paths in touched.items():
+        info = server_info.get(name)
+        if not info:
+            continue
+        root = info["path"]
+        manifest = load_manifest(name)
+        hashes = base[name].copy() if name in base else {}
+        old_cache = cache.get(name, {})
+        new_cache = old_cache.copy()
+
+        def rescan(rel_path, full_path):
+            try:
+                st = full_path.stat()
+            except OSError:
+                return
+            h = scan_file(full_path, rel_path, st, old_cache, new_cache, options, manifest)
+            if h:
+                hashes[rel_path] = h
+
+        if info["is_file"]:
+            hashes.clear()
+            new_cache.clear()
+            rescan(root.name, root)
+        else:
+            for rel_path in sorted(rel_paths):
+                # forget the path and everything below it, then pick up what exists now
+                prefix = rel_path + os.sep if rel_path else ""
+                for f in [f for f in hashes if f == rel_path or f.startswith(prefix)]:
+                    del hashes[f]
+                    new_cache.pop(f, None)
+                full_path = root / rel_path
+                if full_path.is_dir():
+                    if rel_path and not is_tracked(rel_path, rules=options.rules, is_dir=True):
+                        continue
+                    for sub_path, entry in walk_files(root, rules=options.rules, start=rel_path):
+                        rescan(sub_path, Path(entry.path))
+                elif full_path.is_file() and is_tracked(rel_path, rules=options.rules):
+                    rescan(rel_path, full_path)
+
+        if hashes:
+            all_hashes[name] = hashes
+        else:
+            all_hashes.pop(name, None)
+        if hashes != manifest:
+            update_history(name, manifest, hashes, options.generations)
+            save_manifest(name, hashes)
+        cache[name] = new_cache
+
+    save_hash_cache(cache, options.algo, previous=old_caches)
+    return all_hashes
+
+##################
+# merkle
+# one digest per directory and a root per server, so unchanged servers and
+# subtrees are confirmed with a single comparison
+
+def merkle_digest():
+    return hashlib.blake2b(digest_size=16)
+
+def _register_dir(groups: dict, rel_dir: str):
+    if rel_dir in groups:
+        return
+    groups[rel_dir] = ({}, set())
+    # register the new dir with every ancestor that is not known yet
+    child = rel_dir
+    while child:
+        parent = child.rpartition(os.sep)[0]
+        if parent not in groups:
+            groups[parent] = ({}, set())
+            groups[parent][1].add(child)
+            child = parent
+        else:
+            groups[parent][1].add(child)
+            break
+
+def group_by_dir(files: dict[str, str]) -> dict[str, tuple[dict, set]]:
+    # rel dir -> ({file name: digest}, {subdir rel paths}), "" is the server root
+    if isinstance(files, FileIndex):
+        return files.group_by_dir()
+    groups = {"": ({}, set())}
+    for rel_path, digest in files.items():
+        rel_dir, _, name = rel_path.rpartition(os.sep)
+        _register_dir(groups, rel_dir)
+        groups[rel_dir][0][name] = digest
+    return groups
+
+def build_merkle(files: dict[str, str]) -> dict[str, str]:
+    groups = group_by_dir(files)
+    tree = {}
+    # children before parents
+    for rel_dir in sorted(groups, key=lambda d: d.count(os.sep) + bool(d), reverse=True):
+        dir_files, subdirs = groups[rel_dir]
+        h = merkle_digest()
+        for name, digest in sorted(dir_files.items()):
+            h.update(f"f\0{name}\0{digest}\n".encode("utf-8", "surrogateescape"))
+        for subdir in sorted(subdirs):
+            name = subdir.rpartition(os.sep)[2]
+            h.update(f"d\0{name}\0{tree[subdir]}\n".encode("utf-8", "surrogateescape"))
+        tree[rel_dir] = h.hexdigest()
+    return tree
+
+def server_fingerprint(tree: dict[str, str] | None) -> str:
+    return tree[""][:8] if tree else "-"
+
+def _diff_files(old_files: dict, new_files: dict, added: list, removed: list, modified: list):
+    added.extend(f for f in new_files if f not in old_files)
+    removed.extend(f for f in old_files if f not in new_files)
+    modified.extend(f for f in old_files if f in new_files and old_files[f] != new_files[f])
+
+def compare_server_hashes(old: dict, new: dict, old_trees: dict = None, new_trees: dict = None) -> dict[str, dict[str, list]]:
+    # with trees only servers whose roots differ are looked at, and in those
+    # only the directories whose digests differ
+    changes = {}
+    all_servers = set(old.keys()) | set(new.keys())
+
+    for server in all_servers:
+        old_files = old.get(server, {})
+        new_files = new.get(server, {})
+        old_tree = (old_trees or {}).get(server)
+        new_tree = (new_trees or {}).get(server)
+        added, removed, modified = [], [], []
+
+        if old_tree and new_tree:
+            if old_tree[""] == new_tree[""]:
+                continue
+            old_groups = group_by_dir(old_files)
+            new_groups = group_by_dir(new_files)
+            empty = ({}, set())
+            stack = [""]
+            while stack:
+                rel_dir = stack.pop()
+                if old_tree.get(rel_dir) == new_tree.get(rel_dir):
+                    continue
+                old_dir = old_groups.get(rel_dir, empty)
+                new_dir = new_groups.get(rel_dir, empty)
+                prefix = rel_dir + os.sep if rel_dir else ""
+                _diff_files(
+                    {prefix + name: d for name, d in old_dir[0].items()},
+                    {prefix + name: d for name, d in new_dir[0].items()},
+                    added, removed, modified
+                )
+                stack.extend(old_dir[1] | new_dir[1])
+        else:
+            _diff_files(old_files, new_files, added, removed, modified)
+        
+        if added or removed or modified:
+            changes[server] = {
+                "added": added,
+                "removed": removed,
+                "modified": modified,
+                # lets the viewer pull both versions from the object store
+                "old_digests": {f: old_files[f] for f in removed + modified},
+                "new_digests": {f: new_files[f] for f in added + modified},
+                "fingerprint": [server_fingerprint(old_tree), server_fingerprint(new_tree)]
+            }
+    
+    return changes
+
+##################
+# states
+
+##################
+# snapshot store
+# content addressed: objects/ab/cdef... holds the compressed bytes for a digest,
+# manifests/<server>.json maps relative paths to digests
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+def _compressor():
+    if zstandard:
+        return b"Z", zstandard.ZstdCompressor().compressobj()
+    return b"z", zlib.compressobj(6)
+
+def _decompress(codec: bytes, data: bytes) -> bytes:
+    if codec == b"Z":
+        if not zstandard:
+            raise RuntimeError("snapshot was written with zstd, install the zstandard package")
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    return zlib.decompress(data)
+
+def get_object_path(digest: str) -> Path:
+    return get_objects_path() / digest[:2] / digest[2:]
+
+def has_object(digest: str) -> bool:
+    return get_object_path(digest).exists()
+
+def _iter_chunks(src, prefix: bytes = b""):
+    if prefix:
+        yield prefix
+    if isinstance(src, bytes):
+        yield src
+        return
+    while chunk := src.read(HASH_CHUNK_SIZE):
+        yield chunk
+
+def _write_object(digest: str, header: bytes, chunks):
+    # objects start with a kind byte (F full, D delta) and a codec byte,
+    # delta objects add "<depth> <base digest>\n" before the compressed payload
+    object_path = get_object_path(digest)
+    object_path.parent.mkdir(parents=True, exist_ok=True)
+    codec, comp = _compressor()
+    tmp_path = object_path.with_name(f".{object_path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with open(tmp_path, "wb") as out:
+            out.write(header[:1] + codec + header[1:])
+            for chunk in chunks:
+                out.write(comp.compress(chunk))
+            out.write(comp.flush())
+        os.replace(tmp_path, object_path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+def put_object(digest: str, src, base: str = None) -> bool:
+    # src is bytes or a binary file object, base is the previous version of the same file.
+    # returns False when the object was already stored
+    if has_object(digest):
+        return False
+    with metrics.phase("snapshot_write"):
+        stored = _put_object(digest, src, base)
+    metrics.count(f"objects_written_{stored}")
+    return True
+
+def _put_object(digest: str, src, base: str = None) -> str:
+    # returns "delta" or "full"
+    data = b""
+    if base and base != digest:
+        data = src if isinstance(src, bytes) else src.read(DELTA_MAX_SIZE + 1)
+        if len(data) <= DELTA_MAX_SIZE:
+            delta = make_delta(base, data)
+            if delta:
+                _write_object(digest, delta[0], [delta[1]])
+                return "delta"
+        if isinstance(src, bytes):
+            src = b""
+    _write_object(digest, b"F", _iter_chunks(src, data))
+    return "full"
+
+def _read_object_header(digest: str) -> tuple[bytes, int, str | None, int] | None:
+    # (kind, depth, base, payload offset)
+    try:
+        with open(get_object_path(digest), "rb") as f:
+            head = f.read(256)
+    except OSError:
+        return None
+    if head[:1] == b"D":
+        end = head.index(b"\n", 2)
+        depth, base = head[2:end].decode().split(" ")
+        return b"D", int(depth), base, end + 1
+    return b"F", 0, None, 2
+
+def get_object(digest: str) -> bytes | None:
+    # delta chains are capped at MAX_DELTA_DEPTH so this never replays more than that
+    object_path = get_object_path(digest)
+    try:
+        data = object_path.read_bytes()
+    except OSError:
+        return None
+    if data[:1] != b"D":
+        return _decompress(data[1:2], data[2:])
+    end = data.index(b"\n", 2)
+    base = data[2:end].decode().split(" ")[1]
+    base_data = get_object(base)
+    if base_data is None:
+        return None
+    ops = json.loads(_decompress(data[1:2], data[end + 1:]))
+    return apply_delta(base_data, ops)
+
+##################
+# delta
+# line based copy/insert ops against the previous generation
+
+# bigger files are always stored whole
+DELTA_MAX_SIZE = 512 * 1024
+# a full object every this many generations bounds reconstruction work
+MAX_DELTA_DEPTH = 8
+# runs inside the hashing pass, a delta that takes longer is not worth it
+DELTA_TIME_LIMIT = 0.05
+
+def make_delta(base: str, data: bytes) -> tuple[bytes, bytes] | None:
+    header = _read_object_header(base)
+    if header is None or header[1] + 1 >= MAX_DELTA_DEPTH:
+        return None
+    base_data = get_object(base)
+    if base_data is None:
+        return None
+    # latin-1 maps every byte to one char so any content survives the json round trip
+    old_lines = base_data.decode("latin-1").splitlines(keepends=True)
+    new_lines = data.decode("latin-1").splitlines(keepends=True)
+    # mostly rewritten files compress better whole, skip the diff when few lines survive
+    old_set = set(old_lines)
+    if sum(len(line) for line in new_lines if line in old_set) * 2 < len(data):
+        return None
+    opcodes, complete = diff_opcodes(old_lines, new_lines, time.monotonic() + DELTA_TIME_LIMIT)
+    if not complete:
+        return None
+    ops = []
+    inserted = 0
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == "equal":
+            ops.append([i1, i2])
+        elif tag in ("replace", "insert"):
+            text = "".join(new_lines[j1:j2])
+            inserted += len(text)
+            ops.append(text)
+    if inserted * 2 > len(data):
+        return None
+    payload = json.dumps(ops, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return f"D{header[1] + 1} {base}\n".encode(), payload
+
+def apply_delta(base_data: bytes, ops: list) -> bytes:
+    old_lines = base_data.decode("latin-1").splitlines(keepends=True)
+    out = []
+    for op in ops:
+        if isinstance(op, str):
+            out.append(op)
+        else:
+            out.extend(old_lines[op[0]:op[1]])
+    return "".join(out).encode("latin-1")
+
+def get_manifest_path(server_name: str) -> Path:
+    # server names are free text in the config, quote them so they cannot collide
+    return get_manifests_path() / f"{quote(server_name, safe='')}.json"
+
+# one "path":"digest" member of a manifest, save_manifest writes nothing else
+MANIFEST_ENTRY_RE = re.compile(r'"((?:[^"\\]|\\.)*)"\s*:\s*(?:"([0-9a-f]*)"|null)')
+
+def iter_manifest(text: str):
+    # (path, digest) pairs without building the whole dict first
+    for match in MANIFEST_ENTRY_RE.finditer(text):
+        rel_path = match[1]
+        if "\\" in rel_path:
+            rel_path = json.loads(f'"{rel_path}"')
+        yield rel_path, match[2]
+
+def load_manifest(server_name: str) -> dict[str, str]:
+    manifest_path = get_manifest_path(server_name)
+    if manifest_path.exists():
+        try:
+            text = manifest_path.read_text()
+            if len(text) < COMPACT_INDEX_MIN * 64:
+                return compact_files(json.loads(text))
+            # big server, straight into a FileIndex
+            files = FileIndex()
+            entries = iter_manifest(text)
+            while batch := list(itertools.islice(entries, 4096)):
+                files.extend(batch)
+            return files
+        except Exception:
+            pass
+    return {}
+
+def save_manifest(server_name: str, files: dict[str, str]):
+    write_atomic(get_manifest_path(server_name), json.dumps(dict(files), separators=(",", ":")))
+
+##################
+# history
+# history/<server>.json keeps the last generations of every file as
+# [generation, digest, time], digest is null when the file was removed
+
+HISTORY_GENERATIONS = 10
+
+def get_server_history_path(server_name: str) -> Path:
+    return get_history_path() / f"{quote(server_name, safe='')}.json"
+
+def load_history(server_name: str) -> dict[str, list]:
+    history_path = get_server_history_path(server_name)
+    if history_path.exists():
+        try:
+            return json.loads(history_path.read_text())
+        except Exception:
+            pass
+    return {}
+
+def update_history(server_name: str, old: dict, new: dict, generations: int = HISTORY_GENERATIONS):
+    history = load_history(server_name)
+    now = datetime.now().isoformat(timespec="seconds")
+
+    def push(file_path, digest):
+        entries = history.setdefault(file_path, [])
+        if not entries and old.get(file_path) and old[file_path] != digest:
+            # manifest from before history existed, keep it as the first generation
+            entries.append([0, old[file_path], None])
+        if entries and entries[-1][1] == digest:
+            return
+        entries.append([entries[-1][0] + 1 if entries else 0, digest, now])
+        del entries[:-generations]
+
+    for file_path, digest in new.items():
+        push(file_path, digest)
+    for file_path in old:
+        if file_path not in new:
+            push(file_path, None)
+    write_atomic(get_server_history_path(server_name), json.dumps(history, separators=(",", ":")))
+
+def get_generation(server_name: str, file_path: str, generation: int) -> list | None:
+    # negative generations count back from the latest, like list indexes
+    entries = load_history(server_name).get(file_path, [])
+    if generation < 0:
+        return entries[generation] if -generation <= len(entries) else None
+    for entry in entries:
+        if entry[0] == generation:
+            return entry
+    return None
+
+def diff_generations(server_name: str, file_path: str, gen_a: int, gen_b: int) -> list[str] | None:
+    # only the two requested versions are rebuilt, not the ones in between
+    entries = [get_generation(server_name, file_path, g) for g in (gen_a, gen_b)]
+    if None in entries:
+        return None
+    texts = []
+    for entry in entries:
+        content = get_file_snapshot(server_name, file_path, entry[1]) if entry[1] else ""
+        texts.append(content or "")
+    fromfile = f"gen{entries[0][0]}/{file_path}"
+    tofile = f"gen{entries[1][0]}/{file_path}"
+    if entries[0][1] and entries[1][1]:
+        lines = cached_diff_texts(entries[0][1], entries[1][1], texts[0], texts[1], fromfile, tofile)
+    else:
+        lines = diff_texts(texts[0], texts[1], fromfile, tofile)
+    return [line for line, _ in lines]
+
+def get_file_snapshot(server_name: str, file_path: str, digest: str = None) -> str | None:
+    # digest picks a specific version, default is the one in the manifest
+    if digest is None:
+        digest = load_manifest(server_name).get(file_path)
+    if digest is None:
+        return None
+    try:
+        data = get_object(digest)
+    except Exception:
+        return None
+    if data is None:
+        return None
+    return data.decode('utf-8', errors='replace')
+
+def gc_snapshots(keep_servers: set[str] = None) -> tuple[int, int]:
+    # drops manifests of servers not in keep_servers and every object no manifest points to
+    snapshots_dir = get_snapshots_path()
+    if not snapshots_dir.exists():
+        return 0, 0
+    referenced = set()
+    manifests_dir = get_manifests_path()
+    if manifests_dir.exists():
+        for manifest_path in manifests_dir.glob("*.json"):
+            server_name = unquote(manifest_path.stem)
+            if keep_servers is not None and server_name not in keep_servers:
+                manifest_path.unlink()
+                continue
+            referenced.update(load_manifest(server_name).values())
+    history_dir = get_history_path()
+    if history_dir.exists():
+        for history_path in history_dir.glob("*.json"):
+            server_name = unquote(history_path.stem)
+            if keep_servers is not None and server_name not in keep_servers:
+                history_path.unlink()
+                continue
+            for entries in load_history(server_name).values():
+                referenced.update(entry[1] for entry in entries if entry[1])
+    # versions a revert may still restore, quarantined servers' ones included
+    for key in ("pending", "quarantined_pending"):
+        for entries in get_state_meta(key, {}).values():
+            referenced.update(before for before, _ in entries.values() if before)
+
+    # deltas keep their whole base chain alive
+    pending = list(referenced)
+    while pending:
+        header = _read_object_header(pending.pop())
+        if header and header[2] and header[2] not in referenced:
+            referenced.add(header[2])
+            pending.append(header[2])
+
+    removed = freed = 0
+    objects_dir = get_objects_path()
+    if objects_dir.exists():
+        for object_path in objects_dir.glob("*/*"):
+            digest = object_path.parent.name + object_path.name
+            # leftover temp files from an interrupted write are garbage as well
+            if digest not in referenced:
+                freed += object_path.stat().st_size
+                object_path.unlink()
+                removed += 1
+    # cached diffs are only worth keeping while both versions are
+    diffs_dir = get_diffs_path()
+    if diffs_dir.exists():
+        for diff_path in diffs_dir.glob("*/*"):
+            old_digest, _, new_digest = (diff_path.parent.name + diff_path.name).partition("-")
+            if old_digest not in referenced or new_digest not in referenced:
+                freed += diff_path.stat().st_size
+                diff_path.unlink()
+                removed += 1
+    # content findings of versions nobody can look at any more
+    with state_db() as db:
+        stale = [(digest,) for (digest,) in db.execute("SELECT digest FROM content_scan") if digest not in referenced]
+        db.executemany("DELETE FROM content_scan WHERE digest = ?", stale)
+    # flat files from before the object store
+    for legacy in snapshots_dir.glob("*.snapshot"):
+        freed += legacy.stat().st_size
+        legacy.unlink()
+        removed += 1
+    return removed, freed
+
+# meta keys other code keeps up to date while a check runs, a check never writes them back
+SIDE_META_KEYS = ("cache_algo", "package_paths")
+# what check_for_changes writes, anything else in meta is left as it is in the db
+CHECK_META_KEYS = ("hash_algo", "last_hash", "last_check", "last_summary", "config_fields")
+
+def load_state(files: bool = True) -> dict:
+    # without files the per file rows are left out until load_state_files
+    with state_db() as db:
+        state = {key: json.loads(value) for key, value in db.execute("SELECT key, value FROM meta")}
+    for key in SIDE_META_KEYS:
+        state.pop(key, None)
+    if state and files:
+        load_state_files(state)
+    return state
+
+def load_state_files(state: dict):
+    with state_db() as db:
+        state["server_hashes"] = _load_rows(db, "files", "digest", compact=True)
+        state["server_trees"] = _load_rows(db, "trees", "digest")
+
+def save_state(state: dict, previous_hashes: dict = None, previous_trees: dict = None, keys=None, reconcile=None):
+    # previous_* are what load_state returned, only changed rows are written. keys limits
+    # the meta written to those, the rest may have moved on since the state was loaded.
+    # reconcile(db, state) runs first in the same write transaction, to fold in what did
+    with state_db() as db:
+        if reconcile:
+            db.execute("BEGIN IMMEDIATE")
+            reconcile(db, state)
+        _write_state(db, state, previous_hashes, previous_trees, keys)
+
+def _write_state(db: sqlite3.Connection, state: dict, previous_hashes: dict, previous_trees: dict, keys):
+    state = dict(state)
+    server_hashes = state.pop("server_hashes", {})
+    server_trees = state.pop("server_trees", {})
+    if keys is not None:
+        state = {k: state[k] for k in keys if k in state}
+    db.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)", ((k, json.dumps(v)) for k, v in state.items()))
+    _save_rows(db, "files", server_hashes, previous_hashes)
+    _save_rows(db, "trees", server_trees, previous_trees)
+
+##################
+# actions
+# accept, revert and quarantine work on the pending changes: what checks reported since
+# the last accept or revert, {server: {path: [digest before, digest now]}}. anything they
+# are about to replace goes to backups/<time>-<action>/ first, with a copy of state.db.
+# pending and the rows an action changes are read and written in one transaction, so an
+# action and a check saving at the same time never undo each other
+
+# linux ioctl that shares a file's extents, btrfs and xfs support it
+FICLONE = 0x40049409
+
+def merge_pending(pending: dict, server_changes: dict) -> dict:
+    # the oldest digest is kept, a file changed back to it drops out
+    pending = {server_name: dict(entries) for server_name, entries in pending.items()}
+    for server_name, file_changes in server_changes.items():
+        entries = pending.setdefault(server_name, {})
+        for kind in ("added", "removed", "modified"):
+            for f in file_changes[kind]:
+                before = entries[f][0] if f in entries else file_changes["old_digests"].get(f)
+                now = file_changes["new_digests"].get(f)
+                if before == now:
+                    entries.pop(f, None)
+                else:
+                    entries[f] = [before, now]
+        if not entries:
+            del pending[server_name]
+    return pending
+
+def select_pending(pending: dict, server_name: str = None, files: list[str] = ()) -> dict:
+    # every server, one server, or some of its files
+    if server_name is None:
+        return pending
+    entries = pending.get(server_name, {})
+    if files:
+        entries = {f: entries[f] for f in files if f in entries}
+    return {server_name: entries} if entries else {}
+
+def _read_meta(db: sqlite3.Connection, key: str, default=None):
+    row = db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return json.loads(row[0]) if row else default
+
+def _read_pending(db: sqlite3.Connection) -> dict:
+    return _read_meta(db, "pending", {})
+
+def _write_pending(db: sqlite3.Connection, pending: dict):
+    db.execute("INSERT OR REPLACE INTO meta VALUES ('pending', ?)", (json.dumps(pending),))
+
+def _server_rows(db: sqlite3.Connection, table: str, server_name: str) -> dict[str, str]:
+    return dict(db.execute(f"SELECT path, digest FROM {table} WHERE server = ?", (server_name,)))
+
+def reconcile_pending(db: sqlite3.Connection, state: dict, start_pending: dict, server_changes: dict):
+    # a check saving: accepts and reverts made since it loaded the state show up as entries
+    # of start_pending that changed or left. their files keep the rows the action wrote,
+    # everything else the check found is merged into pending as it is now
+    pending = _read_pending(db)
+    acted = {}
+    for server_name, entries in start_pending.items():
+        for f, entry in entries.items():
+            if pending.get(server_name, {}).get(f) != entry:
+                acted.setdefault(server_name, set()).add(f)
+    for server_name, paths in acted.items():
+        if server_name not in state["server_hashes"]:
+            continue
+        files = state["server_hashes"][server_name] = state["server_hashes"][server_name].copy()
+        for f in paths:
+            row = db.execute("SELECT digest FROM files WHERE server = ? AND path = ?", (server_name, f)).fetchone()
+            if row:
+                files[f] = row[0]
+            else:
+                files.pop(f, None)
+        state["server_trees"][server_name] = build_merkle(files)
+    unacted = {
+        server_name: {**file_changes, **{
+            kind: [f for f in file_changes[kind] if f not in acted.get(server_name, ())]
+            for kind in ("added", "removed", "modified")
+        }}
+        for server_name, file_changes in server_changes.items()
+    }
+    pending = merge_pending(pending, unacted)
+    state["pending"] = {server_name: entries for server_name, entries in pending.items() if server_name in state["server_hashes"]}
+
+def drop_pending(pending: dict, selected: dict) -> dict:
+    pending = {server_name: dict(entries) for server_name, entries in pending.items()}
+    for server_name, entries in selected.items():
+        for f in entries:
+            pending.get(server_name, {}).pop(f, None)
+        if not pending.get(server_name):
+            pending.pop(server_name, None)
+    return pending
+
+def clone_file(src: Path, dest: Path):
+    # no bytes copied where the filesystem can help: a hard link, else a reflink
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.link(src, dest)
+        return
+    except OSError:
+        pass
+    try:
+        if sys.platform.startswith("linux"):
+            import fcntl
+            with open(src, "rb") as s, open(dest, "wb") as d:
+                fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+            shutil.copystat(src, dest)
+            return
+        if sys.platform == "darwin":
+            import ctypes
+            import ctypes.util
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or None)
+            if libc.clonefile(os.fsencode(src), os.fsencode(dest), 0) == 0:
+                return
+    except (OSError, AttributeError):
+        dest.unlink(missing_ok=True)
+    shutil.copy2(src, dest)
+
+def get_umask() -> int:
+    # linux reports it, elsewhere os.umask can only be read by setting it for a moment
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("Umask:"):
+                    return int(line.split()[1], 8)
+    except (OSError, ValueError):
+        pass
+    umask = os.umask(0o077)
+    os.umask(umask)
+    return umask
+
+def restored_mode(data: bytes) -> int:
+    # modes are not snapshotted. a file brought back from nothing gets what a new file
+    # would, plus the exec bits when it is a script so a launcher can still run it
+    mode = 0o777 if data.startswith(b"#!") else 0o666
+    return mode & ~get_umask()
+
+def start_backup(action: str) -> Path:
+    backup_dir = get_backups_path() / f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{action}"
+    backup_dir.mkdir(parents=True)
+    with state_db() as db:
+        target = sqlite3.connect(backup_dir / "state.db")
+        try:
+            db.backup(target)
+        finally:
+            target.close()
+    return backup_dir
+
+def backup_server_file(backup_dir: Path, server_name: str, rel_path: str, path: Path):
+    # the files are replaced or unlinked right after, never written in place, so a link is a real copy
+    if path.is_file():
+        clone_file(path, backup_dir / "files" / quote(server_name, safe="") / rel_path)
+
+def _apply_digests(mapping, entries: dict):
+    for f, digest in entries.items():
+        if digest is None:
+            mapping.pop(f, None)
+        else:
+            mapping[f] = digest
+
+def _record_files(updates: dict, done: dict):
+    # {server: {path: digest or None}} into the rows as they are now, the trees, manifests
+    # and history. done is what leaves pending
+    with state_db() as db:
+        db.execute("BEGIN IMMEDIATE")
+        _write_pending(db, drop_pending(_read_pending(db), done))
+        for server_name, entries in updates.items():
+            old_files = _server_rows(db, "files", server_name)
+            files = dict(old_files)
+            _apply_digests(files, entries)
+            _save_rows(db, "files", {server_name: files}, {server_name: old_files})
+            _save_rows(db, "trees", {server_name: build_merkle(files)}, {server_name: _server_rows(db, "trees", server_name)})
+    for server_name, entries in updates.items():
+        manifest = load_manifest(server_name)
+        old_manifest = manifest.copy()
+        _apply_digests(manifest, entries)
+        save_manifest(server_name, manifest)
+        update_history(server_name, old_manifest, manifest)
+
+def accept_changes(server_name: str = None, files: list[str] = ()) -> dict:
+    # the state already holds what is on disk, accepting only clears the review
+    with state_db() as db:
+        db.execute("BEGIN IMMEDIATE")
+        pending = _read_pending(db)
+        selected = select_pending(pending, server_name, files)
+        if selected:
+            _write_pending(db, drop_pending(pending, selected))
+    return selected
+
+def revert_changes(server_name: str = None, files: list[str] = ()) -> dict:
+    # every selected file goes back to its version before the change, added files are
+    # removed. all versions are staged next to their targets first, then renamed over them,
+    # so a missing snapshot or a full disk leaves the tree untouched
+    selected = select_pending(get_state_meta("pending", {}), server_name, files)
+    if not selected:
+        return {}
+    server_info = get_server_paths(get_config_path())
+    staged = []
+    try:
+        for name, entries in selected.items():
+            for f, (before, _) in entries.items():
+                target = resolve_changed_file(server_info, name, f)
+                if target is None:
+                    raise RuntimeError(f"nothing reverted, {name} is not in the config")
+                temp = None
+                if before is not None:
+                    data = get_object(before)
+                    if data is None:
+                        raise RuntimeError(f"nothing reverted, no snapshot of {name}/{f}")
+                    target.parent.mkdir(parents=True, exist_ok=True)
+                    fd, temp = tempfile.mkstemp(dir=target.parent, prefix=f".{target.name}.", suffix=".revert")
+                    with os.fdopen(fd, "wb") as out:
+                        out.write(data)
+                        out.flush()
+                        os.fsync(out.fileno())
+                    if target.exists():
+                        shutil.copymode(target, temp)
+                    else:
+                        os.chmod(temp, restored_mode(data))
+                staged.append((name, f, target, temp))
+        backup_dir = start_backup("revert")
+        for name, f, target, _ in staged:
+            backup_server_file(backup_dir, name, f, target)
+    except BaseException:
+        for *_, temp in staged:
+            if temp:
+                Path(temp).unlink(missing_ok=True)
+        raise
+    write_atomic(backup_dir / "backup.json", json.dumps({"action": "revert", "files": selected}, indent=2))
+    # renames only fail on a file yanked away under us, what was swapped before is still recorded
+    done = {}
+    try:
+        for name, f, target, temp in staged:
+            if temp:
+                os.replace(temp, target)
+            else:
+                target.unlink(missing_ok=True)
+            done.setdefault(name, {})[f] = selected[name][f]
+    except OSError as e:
+        for *_, temp in staged:
+            if temp:
+                Path(temp).unlink(missing_ok=True)
+        error = RuntimeError(f"reverted {sum(map(len, done.values()))} of {len(staged)} file(s), then {e}")
+    else:
+        error = None
+    _record_files({name: {f: before for f, (before, _) in entries.items()} for name, entries in done.items()}, done)
+    if error:
+        raise error
+    return selected
+
+def _set_config_baseline(db: sqlite3.Connection, config_path: Path):
+    # our own edit of the config is not a change to report
+    row = db.execute("SELECT value FROM meta WHERE key = 'hash_algo'").fetchone()
+    config = load_config(config_path)
+    baseline = {
+        "last_hash": file_hash(config_path, json.loads(row[0]) if row else DEFAULT_HASH_ALGO),
+        "last_summary": config.summary,
+        "config_fields": config.fields,
+    }
+    db.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)", ((k, json.dumps(v)) for k, v in baseline.items()))
+
+def quarantined_servers(config_path: Path) -> set[str]:
+    try:
+        return set(json.loads(config_path.read_text()).get("quarantinedMcpServers", {}))
+    except (OSError, ValueError, AttributeError):
+        return set()
+
+def _move_config_server(config_path: Path, server_name: str, source: str, dest: str, action: str) -> Path:
+    config = json.loads(config_path.read_text())
+    if server_name not in config.get(source, {}):
+        raise KeyError(server_name)
+    backup_dir = start_backup(action)
+    clone_file(config_path, backup_dir / config_path.name)
+    config.setdefault(dest, {})[server_name] = config[source].pop(server_name)
+    if not config[source]:
+        del config[source]
+    write_atomic(config_path, json.dumps(config, indent=2))
+    return backup_dir
+
+def quarantine(server_name: str, files: list[str] = ()) -> Path:
+    # files are moved out of the tree into the backup. a whole server is moved from
+    # mcpServers to quarantinedMcpServers so Claude no longer starts it, its files stay put
+    config_path = get_config_path()
+    if not files:
+        backup_dir = _move_config_server(config_path, server_name, "mcpServers", "quarantinedMcpServers", "quarantine")
+        with state_db() as db:
+            db.execute("BEGIN IMMEDIATE")
+            _set_config_baseline(db, config_path)
+            # rows come back from the manifest on release, its pending changes are held
+            # until then so quarantining never approves them
+            db.execute("DELETE FROM files WHERE server = ?", (server_name,))
+            db.execute("DELETE FROM trees WHERE server = ?", (server_name,))
+            pending = _read_pending(db)
+            held = _read_meta(db, "quarantined_pending", {})
+            held[server_name] = pending.pop(server_name, {})
+            _write_pending(db, pending)
+            db.execute("INSERT OR REPLACE INTO meta VALUES ('quarantined_pending', ?)", (json.dumps(held),))
+        write_atomic(backup_dir / "backup.json", json.dumps({"action": "quarantine", "server": server_name, "pending": held[server_name]}, indent=2))
+        return backup_dir
+    server_info = get_server_paths(config_path)
+    targets = []
+    for f in files:
+        target = resolve_changed_file(server_info, server_name, f)
+        if target is None:
+            raise KeyError(server_name)
+        targets.append((f, target))
+    backup_dir = start_backup("quarantine")
+    for f, target in targets:
+        backup_server_file(backup_dir, server_name, f, target)
+        target.unlink(missing_ok=True)
+    write_atomic(backup_dir / "backup.json", json.dumps({"action": "quarantine", "files": {server_name: files}}, indent=2))
+    _record_files({server_name: dict.fromkeys(files)}, {server_name: dict.fromkeys(files)})
+    return backup_dir
+
+def release(server_name: str) -> Path:
+    # back into mcpServers. its rows start from the last manifest with the changes held at
+    # quarantine rolled back to their before digests, so the next check reports them again
+    # along with anything changed since, and --revert still restores the old version
+    config_path = get_config_path()
+    backup_dir = _move_config_server(config_path, server_name, "quarantinedMcpServers", "mcpServers", "release")
+    files = load_manifest(server_name)
+    with state_db() as db:
+        db.execute("BEGIN IMMEDIATE")
+        _set_config_baseline(db, config_path)
+        held = _read_meta(db, "quarantined_pending", {})
+        _apply_digests(files, {f: before for f, (before, _) in held.pop(server_name, {}).items()})
+        db.execute("INSERT OR REPLACE INTO meta VALUES ('quarantined_pending', ?)", (json.dumps(held),))
+        _save_rows(db, "files", {server_name: files}, {server_name: _server_rows(db, "files", server_name)})
+        _save_rows(db, "trees", {server_name: build_merkle(files)}, {server_name: _server_rows(db, "trees", server_name)})
+    return backup_dir
+
+###################
+
+def get_config_summary(path: Path) -> str:
+    return load_config(path).summary
+
+####################
 # is claude running 
 
-def is_claude_running() -> bool:
+# exact executable names of the desktop app, so our own "python claudeDefender.py" never
+# matches. a plain "claude" is the Claude Code cli as often as the app
+CLAUDE_PROCESS_NAMES = {"Claude", "claude-desktop"}
+# the desktop app is electron: its exe or cmdline name the app dir or its app.asar.
+# the cli lives in bin/ or claude/versions/ and runs no asar
+CLAUDE_DESKTOP_PATH_RE = re.compile(r"claude-desktop|Claude\.app/|claude[^/]*/(?:[^/]+/)*app\.asar", re.IGNORECASE)
+
+# pid -> start time of the claude process found last, checked before rescanning /proc
+_claude_pid = None
+# pid -> comm of processes already seen not to be claude. a scan still reads comm, exec
+# keeps the pid but changes it, anything else is skipped while comm stays the same
+_non_claude_pids = {}
+
+def _proc_start_time(pid: int) -> int | None:
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # comm can contain spaces and parens, fields restart after the last ")"
+    return int(stat[stat.rindex(b")") + 2:].split()[19])
+
+def _proc_comm(pid: int) -> str | None:
+    try:
+        with open(f"/proc/{pid}/comm") as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+def _proc_is_claude(pid: int, comm: str) -> bool:
+    if comm in CLAUDE_PROCESS_NAMES:
+        return True
+    # exe and cmdline are only read for names that may be the app, not for every process
+    if "claude" not in comm.lower() and "electron" not in comm.lower():
+        return False
+    try:
+        exe = os.readlink(f"/proc/{pid}/exe")
+        if os.path.basename(exe) in CLAUDE_PROCESS_NAMES or CLAUDE_DESKTOP_PATH_RE.search(exe):
+            return True
+        with open(f"/proc/{pid}/cmdline", "rb") as f:
+            cmdline = f.read().decode("utf-8", "replace").split("\0")
+    except OSError:
+        return False
+    return any(CLAUDE_DESKTOP_PATH_RE.search(arg) for arg in cmdline[:2])
+
+def find_claude_pid() -> int | None:
+    # the oldest match is the electron main process, helpers start after it
+    global _claude_pid
+    if _claude_pid:
+        pid, start_time = _claude_pid
+        if _proc_start_time(pid) == start_time:
+            return pid
+        _claude_pid = None
+
+    own_pid = os.getpid()
+    pids = {int(name) for name in os.listdir("/proc") if name.isdigit()}
+    for pid in _non_claude_pids.keys() - pids:
+        del _non_claude_pids[pid]
+    best = None
+    for pid in pids:
+        if pid == own_pid:
+            continue
+        comm = _proc_comm(pid)
+        if comm is None or _non_claude_pids.get(pid) == comm:
+            continue
+        if not _proc_is_claude(pid, comm):
+            _non_claude_pids[pid] = comm
+            continue
+        start_time = _proc_start_time(pid)
+        if start_time is not None and (best is None or start_time < best[1]):
+            best = (pid, start_time)
+    if best:
+        _claude_pid = best
+        return best[0]
+    return None
+
+def open_claude_pidfd() -> int | None:
+    # fd that turns readable when claude exits, linux 5.3+ only
+    pid = find_claude_pid() if sys.platform.startswith("linux") else None
+    if pid is None or not hasattr(os, "pidfd_open"):
+        return None
+    try:
+        return os.pidfd_open(pid)
+    except OSError:
+        return None
+
+def is_claude_running() -> bool:
+    try:
+        if sys.platform == "win32":
+            result = subprocess.run(
+                ["tasklist", "/FI", "IMAGENAME eq claude.exe"],
+                capture_output=True, text=True
+            )
+            return "claude.exe" in result.stdout
+        elif sys.platform == "darwin":
+            # the app bundle's executable, the cli is a "claude" too
+            result = subprocess.run(
+                ["pgrep", "-f", "Claude.app/Contents/MacOS/Claude"],
+                capture_output=True
+            )
+            return result.returncode == 0
+        else:  # Linux, read /proc instead of forking pgrep every poll
+            return find_claude_pid() is not None
+    except Exception:
+        return False
+
+def wait_for_claude_startup(poll_interval: float = 1.0):
+    print("Waiting for Claude Desktop to start...")
+    was_running = is_claude_running()
+    while True:
+        running = is_claude_running()
+        # detect fresh
+        if running and not was_running:
+            print("Claude Desktop started!")
+            time.sleep(2)
+            return True
+        was_running = running
+        time.sleep(poll_interval)
+
+#####################
+# file watcher
+# inotify on linux, falls back to polling when it is missing or out of watches
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+              | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+
+# events are coalesced until the tree has been quiet this long, or for at most DEBOUNCE_MAX
+DEBOUNCE = 0.5
+DEBOUNCE_MAX = 5.0
+# full stat scan interval for the polling fallback, cheap thanks to the hash cache
+POLL_INTERVAL = 30.0
+
+def empty_touched() -> dict:
+    return {"config": False, "servers": {}}
+
+class InotifyWatcher:
+    def __init__(self, config_path: Path, rules: IgnoreRules):
+        import ctypes
+        import ctypes.util
+        self.ctypes = ctypes
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or None, use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.rules = rules
+        self.config_path = config_path
+        # wd -> [(server or None for the config, server root, rel dir, only this file name)]
+        self.watches = {}
+        self.pending = empty_touched()
+        try:
+            self._add_watch(config_path.parent, (None, config_path.parent, "", config_path.name))
+            for name, info in get_server_paths(config_path).items():
+                path = info["path"]
+                if info["is_file"]:
+                    self._add_watch(path.parent, (name, path.parent, "", path.name))
+                else:
+                    self._add_tree(name, path, "")
+        except OSError:
+            self.close()
+            raise
+
+    def _add_watch(self, path: Path, target: tuple):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(str(path)), WATCH_MASK | IN_ONLYDIR)
+        if wd < 0:
+            err = self.ctypes.get_errno()
+            if err == errno.ENOSPC:
+                raise OSError(err, "inotify watch limit reached (fs.inotify.max_user_watches)")
+            # gone or unreadable, the next full check will notice
+            return
+        self.watches.setdefault(wd, [])
+        if target not in self.watches[wd]:
+            self.watches[wd].append(target)
+
+    def _add_tree(self, name: str, root: Path, start: str):
+        for rel_dir, _ in walk_tree(root, self.rules, start):
+            self._add_watch(root / rel_dir, (name, root, rel_dir.replace("/", os.sep), None))
+
+    def _touch(self, name: str, rel_path: str):
+        self.pending["servers"].setdefault(name, set()).add(rel_path)
+
+    def _handle(self, wd: int, mask: int, file_name: str):
+        if mask & IN_Q_OVERFLOW:
+            # events were dropped, only a full check is safe
+            self.pending["config"] = True
+            return
+        for name, root, rel_dir, only in self.watches.get(wd, []):
+            if only is not None:
+                if file_name == only or mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                    if name is None:
+                        self.pending["config"] = True
+                    else:
+                        self._touch(name, only)
+                continue
+            if not file_name:
+                # the watched dir itself went away
+                if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                    self._touch(name, rel_dir)
+                continue
+            rel_path = os.path.join(rel_dir, file_name) if rel_dir else file_name
+            if mask & IN_ISDIR:
+                if not is_tracked(rel_path, rules=self.rules, is_dir=True):
+                    continue
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    try:
+                        self._add_tree(name, root, rel_path)
+                    except OSError:
+                        # out of watches, a full check still covers it
+                        self.pending["config"] = True
+                self._touch(name, rel_path)
+            elif is_tracked(rel_path, rules=self.rules):
+                self._touch(name, rel_path)
+        if mask & IN_IGNORED:
+            self.watches.pop(wd, None)
+
+    def _read(self) -> bool:
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return False
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = struct.unpack_from("iIII", data, offset)
+            offset += 16
+            file_name = data[offset:offset + length].rstrip(b"\0").decode(errors="surrogateescape")
+            offset += length
+            self._handle(wd, mask, file_name)
+        return True
+
+    def _take(self) -> dict:
+        touched, self.pending = self.pending, empty_touched()
+        return touched
+
+    def drain(self) -> dict:
+        # everything that happened since the last call, without blocking
+        while self._read():
+            pass
+        return self._take()
+
+    def wait(self, timeout: float, wake_fd: int = None) -> dict | None:
+        # blocks until something changed (debounced), timeout or wake_fd is readable,
+        # None when nothing changed
+        fds = [self.fd] if wake_fd is None else [self.fd, wake_fd]
+        ready, _, _ = select.select(fds, [], [], timeout)
+        if self.fd not in ready:
+            return None
+        deadline = time.monotonic() + DEBOUNCE_MAX
+        while True:
+            self._read()
+            left = deadline - time.monotonic()
+            if left <= 0:
+                break
+            ready, _, _ = select.select([self.fd], [], [], min(DEBOUNCE, left))
+            if not ready:
+                break
+        touched = self._take()
+        if not touched["config"] and not touched["servers"]:
+            return None
+        return touched
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+def sleep_or_wake(seconds: float, wake_fd: int = None) -> bool:
+    # True when wake_fd cut the sleep short
+    if wake_fd is None:
+        time.sleep(seconds)
+        return False
+    ready, _, _ = select.select([wake_fd], [], [], seconds)
+    return bool(ready)
+
+class PollingWatcher:
+    # no events to go on, so every poll asks for a full (stat cached) check
+    def __init__(self, interval: float = POLL_INTERVAL):
+        self.interval = interval
+        self.next_poll = time.monotonic() + interval
+
+    def drain(self) -> dict:
+        self.next_poll = time.monotonic() + self.interval
+        return {"config": True, "servers": {}}
+
+    def wait(self, timeout: float, wake_fd: int = None) -> dict | None:
+        remaining = self.next_poll - time.monotonic()
+        if remaining > timeout:
+            sleep_or_wake(timeout, wake_fd)
+            return None
+        if sleep_or_wake(max(0, remaining), wake_fd):
+            return None
+        return self.drain()
+
+    def close(self):
+        pass
+
+def start_watcher(config_path: Path, rules: IgnoreRules):
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(config_path, rules)
+        except (OSError, AttributeError) as e:
+            print(f"inotify unavailable ({e}), polling every {POLL_INTERVAL:.0f}s instead")
+    return PollingWatcher()
+
+#####################
+# daemon
+# the watch loop runs headless and pushes change events as json lines over a unix
+# socket. ui clients attach with --ui, tkinter is only imported there
+
+def daemon_supported() -> bool:
+    return hasattr(socket, "AF_UNIX")
+
+def encode_event(event: dict) -> bytes:
+    return json.dumps(event, default=str).encode("utf-8") + b"\n"
+
+class DaemonServer:
+    def __init__(self, socket_path: Path):
+        self.socket_path = socket_path
+        self.clients = []
+        self.lock = threading.Lock()
+        # a change nobody was attached for, handed to the next client
+        self.pending = None
+        self.status = {"pid": os.getpid(), "started": datetime.now().isoformat()}
+        # bind creates the socket with umask permissions before the chmod below can
+        # tighten them, a 0700 dir keeps everyone else out in between
+        socket_path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+        os.chmod(socket_path.parent, 0o700)
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(str(socket_path))
+        except OSError:
+            # nothing listening, at most a stale socket from a daemon that died
+            socket_path.unlink(missing_ok=True)
+        else:
+            raise RuntimeError(f"a daemon is already listening on {socket_path}")
+        finally:
+            probe.close()
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(str(socket_path))
+        # change details name files and servers, other users have no business reading them
+        os.chmod(socket_path, 0o600)
+        self.sock.listen(8)
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+
+    def _accept_loop(self):
+        while True:
+            try:
+                client, _ = self.sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(client,), daemon=True).start()
+
+    def _serve(self, client: socket.socket):
+        client.settimeout(5)
+        with self.lock:
+            event, self.pending = self.pending, None
+            try:
+                client.sendall(encode_event({"type": "hello", **self.status}))
+                if event:
+                    client.sendall(encode_event(event))
+            except OSError:
+                client.close()
+                return
+            self.clients.append(client)
+        # requests are json lines too, {"cmd": "status"} is the only one so far
+        client.settimeout(None)
+        reader = client.makefile("rb")
+        try:
+            for line in reader:
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    continue
+                if request.get("cmd") == "status":
+                    with self.lock:
+                        client.sendall(encode_event({"type": "status", **self.status}))
+        except OSError:
+            pass
+        finally:
+            reader.close()
+            self._drop(client)
+
+    def _drop(self, client: socket.socket):
+        with self.lock:
+            if client in self.clients:
+                self.clients.remove(client)
+        client.close()
+
+    def update_status(self, **fields):
+        with self.lock:
+            self.status.update(fields)
+
+    def broadcast(self, event: dict) -> int:
+        # returns how many clients got it, with none attached it waits for the next one
+        data = encode_event(event)
+        delivered = 0
+        with self.lock:
+            clients = list(self.clients)
+        for client in clients:
+            try:
+                with self.lock:
+                    client.sendall(data)
+                delivered += 1
+            except OSError:
+                self._drop(client)
+        if not delivered:
+            with self.lock:
+                self.pending = event
+        return delivered
+
+    def close(self):
+        self.sock.close()
+        self.socket_path.unlink(missing_ok=True)
+        with self.lock:
+            clients, self.clients = self.clients, []
+        for client in clients:
+            client.close()
+
+def connect_daemon() -> socket.socket | None:
+    if not daemon_supported():
+        return None
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(str(get_socket_path()))
+    except OSError:
+        client.close()
+        return None
+    return client
+
+def spawn_ui_client(duration: int) -> subprocess.Popen:
+    # own session, so the window outlives a daemon restart
+    return subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--ui", "--duration", str(duration)],
+        stdin=subprocess.DEVNULL,
+        start_new_session=True
+    )
+
+def read_events(client: socket.socket):
+    # yields batches of events, everything that arrived while the caller was busy comes in one batch
+    buffer = b""
+    while True:
+        while b"\n" not in buffer:
+            chunk = client.recv(65536)
+            if not chunk:
+                return
+            buffer += chunk
+        while select.select([client], [], [], 0)[0]:
+            chunk = client.recv(65536)
+            if not chunk:
+                break
+            buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        yield [json.loads(line) for line in lines if line]
+
+def query_daemon_status() -> dict | None:
+    client = connect_daemon()
+    if client is None:
+        return None
     try:
-        if sys.platform == "win32":
-            result = subprocess.run(
-                ["tasklist", "/FI", "IMAGENAME eq claude.exe"],
-                capture_output=True, text=True
-            )
-            return "claude.exe" in result.stdout
-        elif sys.platform == "darwin":
-            result = subprocess.run(
-                ["pgrep", "-x", "claude"],
-                capture_output=True
-            )
-            return result.returncode == 0
-        else:  # Linux
-            result = subprocess.run(
-                ["pgrep", "-f", "claude"],
-                capture_output=True
-            )
-            return result.returncode == 0
-    except Exception:
+        client.settimeout(5)
+        client.sendall(encode_event({"cmd": "status"}))
+        for batch in read_events(client):
+            for event in batch:
+                if event.get("type") == "status":
+                    return event
+    except OSError:
+        return None
+    finally:
+        client.close()
+    return None
+
+def run_ui_client(duration: int) -> bool:
+    # one overlay per batch of change events until the daemon goes away. later phases of
+    # the check an overlay is open for go into that overlay instead of a new one
+    client = connect_daemon()
+    if client is None:
         return False
+    events = queue.Queue()
+    lock = threading.Lock()
+    # check id and updates queue of the open overlay
+    shown = {"check": None, "updates": None}
+    # summary last shown per check, a full phase that only confirms it is not shown again
+    seen = {}
 
-def wait_for_claude_startup(poll_interval: float = 1.0):
-    print("Waiting for Claude Desktop to start...")
-    was_running = is_claude_running()
-    while True:
-        running = is_claude_running()
-        # detect fresh
-        if running and not was_running:
-            print("Claude Desktop started!")
-            time.sleep(2)
-            return True
-        was_running = running
-        time.sleep(poll_interval)
+    def pump():
+        try:
+            for batch in read_events(client):
+                for event in batch:
+                    if event.get("type") != "changes":
+                        continue
+                    with lock:
+                        if shown["updates"] is not None and event.get("check") == shown["check"]:
+                            seen[shown["check"]] = event["summary"]
+                            shown["updates"].put({"message": event["summary"], "changes": event["changes"], "done": event.get("phase") != "quick"})
+                            continue
+                    events.put(event)
+        except OSError:
+            pass
+        finally:
+            events.put(None)
 
-#####################
+    threading.Thread(target=pump, daemon=True).start()
+    try:
+        while True:
+            batch = [events.get()]
+            while not events.empty():
+                batch.append(events.get_nowait())
+            changes = [event for event in batch if event is not None]
+            if changes:
+                # only the newest of the ones that piled up while an overlay was open
+                event = changes[-1]
+                check = event.get("check")
+                if not (event.get("phase") == "full" and seen.get(check) == event["summary"]):
+                    updates = queue.Queue()
+                    with lock:
+                        shown["check"], shown["updates"] = check, updates
+                        seen[check] = event["summary"]
+                    try:
+                        show_overlay(
+                            event["title"],
+                            event["summary"],
+                            duration,
+                            changes=event["changes"],
+                            config_path=Path(event["config_path"]),
+                            updates=updates if event.get("phase") == "quick" else None
+                        )
+                    finally:
+                        with lock:
+                            shown["check"], shown["updates"] = None, None
+            if None in batch:
+                break
+    finally:
+        client.close()
+    return True
 
 #####################
 # overlay notification
 
-def show_overlay(title: str, message: str, duration: int = 5000, changes: dict = None, config_path: Path = None):
-    root = tk.Tk()
+# how often an open overlay looks for updates from the full check
+OVERLAY_POLL_MS = 100
+
+def show_overlay(title: str, message: str, duration: int = 5000, changes: dict = None, config_path: Path = None, updates: queue.Queue = None):
+    # updates carries {"message", "changes", "done"} from a check still running,
+    # the overlay shows the newest and opens the review window on it
+    with metrics.phase("tk_startup"):
+        import tkinter as tk
+        root = tk.Tk()
     root.title("ClaudeDefender")
     root.iconphoto(True, tk.PhotoImage(file="./logo.png"))
     root.overrideredirect(True)
@@ -324,6 +3234,7 @@ def show_overlay(title: str, message: str, duration: int = 5000, changes: dict =
     border_color = "#5C2A2B"
     btn_bg = "#5C2A2B"
     btn_hover = "#7C3A3B"
+    risk_color = "#FFB86C"
     root.configure(bg=bg_color)
     outer = tk.Frame(root, bg=border_color, padx=1, pady=1)
     outer.pack(fill="both", expand=True)
@@ -343,7 +3254,7 @@ def show_overlay(title: str, message: str, duration: int = 5000, changes: dict =
     
     text_frame = tk.Frame(content, bg=bg_color)
     text_frame.pack(side="left", fill="both", expand=True)
-    full_text = f"{title}: {message}"
+    full_text = f"{title}: {message}" + (" (checking the rest...)" if updates else "")
 
     msg_label = tk.Label(
         text_frame,
@@ -358,7 +3269,28 @@ def show_overlay(title: str, message: str, duration: int = 5000, changes: dict =
     btn_frame = tk.Frame(frame, bg=bg_color)
     btn_frame.pack(side="right", padx=(10, 0))
 
-    if changes:
+    current = {"changes": changes, "review_btn": None}
+
+    # the riskiest changed file, under the message
+    risk_label = tk.Label(
+        text_frame,
+        text="",
+        font=("Segoe UI", 9, "bold"),
+        fg=risk_color,
+        bg=bg_color,
+        wraplength=450,
+        justify="left"
+    )
+
+    def show_risk():
+        text = risk_summary(current["changes"] or {})
+        if text:
+            risk_label.config(text=text)
+            risk_label.pack(anchor="w", pady=(4, 0))
+
+    show_risk()
+
+    def add_review_button():
         def on_enter(e):
             review_btn.config(bg=btn_hover)
         def on_leave(e):
@@ -366,9 +3298,9 @@ def show_overlay(title: str, message: str, duration: int = 5000, changes: dict =
         
         def open_review():
             root.destroy()
-            show_diff_viewer(changes, config_path)
+            show_diff_viewer(current["changes"], config_path)
         
-        review_btn = tk.Label(
+        review_btn = current["review_btn"] = tk.Label(
             btn_frame,
             text="Review changes",
             font=("Segoe UI", 9),
@@ -382,6 +3314,9 @@ def show_overlay(title: str, message: str, duration: int = 5000, changes: dict =
         review_btn.bind("<Button-1>", lambda e: open_review())
         review_btn.bind("<Enter>", on_enter)
         review_btn.bind("<Leave>", on_leave)
+
+    if changes:
+        add_review_button()
     
     close_btn = tk.Label(
         btn_frame,
@@ -401,7 +3336,26 @@ def show_overlay(title: str, message: str, duration: int = 5000, changes: dict =
     y = 60
     root.geometry(f"+{x}+{y}")
     timeout = duration * 2 if changes else duration
-    root.after(timeout, root.destroy)
+    timer = {"id": root.after(timeout, root.destroy)}
+
+    def poll_updates():
+        try:
+            while True:
+                update = updates.get_nowait()
+                current["changes"] = update.get("changes") or current["changes"]
+                msg_label.config(text=f"{title}: {update['message']}" + ("" if update.get("done") else " (checking the rest...)"))
+                show_risk()
+                if current["changes"] and current["review_btn"] is None:
+                    add_review_button()
+                # the newest result gets the full time on screen
+                root.after_cancel(timer["id"])
+                timer["id"] = root.after(timeout, root.destroy)
+        except queue.Empty:
+            pass
+        root.after(OVERLAY_POLL_MS, poll_updates)
+
+    if updates is not None:
+        root.after(OVERLAY_POLL_MS, poll_updates)
     def start_drag(event):
         root._drag_x = event.x
         root._drag_y = event.y
@@ -426,12 +3380,383 @@ def show_overlay(title: str, message: str, duration: int = 5000, changes: dict =
 
 #####################
 
+#####################
+# diff engine
+# patience anchors, then linear space myers between them. work is capped by
+# DIFF_TIME_LIMIT, files with huge lines are diffed by token instead
+
+DIFF_TIME_LIMIT = 2.0
+DIFF_CONTEXT = 3
+# past this the texts are only compared at their ends
+DIFF_MAX_CHARS = 8 * 1024 * 1024
+# a line this long means minified or generated, line diffs are useless there
+MINIFIED_LINE_CHARS = 1000
+DIFF_TOKEN_CONTEXT = 8
+# longer lines are cut when shown
+DIFF_MAX_LINE_CHARS = 2000
+TOKEN_RE = re.compile(r"\w+|\s+|[^\w\s]")
+
+def _patience_anchors(a: list, b: list) -> list[tuple[int, int]]:
+    # lines unique in both sides, longest run that keeps their order
+    unique_a = {}
+    for i, x in enumerate(a):
+        unique_a[x] = -1 if x in unique_a else i
+    unique_b = {}
+    for j, x in enumerate(b):
+        unique_b[x] = -1 if x in unique_b else j
+    pairs = [(i, unique_b[x]) for x, i in unique_a.items() if i >= 0 and unique_b.get(x, -1) >= 0]
+    pairs.sort()
+    tails = []
+    tail_pairs = []
+    links = {}
+    for pair in pairs:
+        k = bisect.bisect_left(tails, pair[1])
+        links[pair] = tail_pairs[k - 1] if k else None
+        if k == len(tails):
+            tails.append(pair[1])
+            tail_pairs.append(pair)
+        else:
+            tails[k] = pair[1]
+            tail_pairs[k] = pair
+    anchors = []
+    pair = tail_pairs[-1] if tail_pairs else None
+    while pair is not None:
+        anchors.append(pair)
+        pair = links[pair]
+    anchors.reverse()
+    return anchors
+
+def _myers_split(a: list, b: list, a0: int, a1: int, b0: int, b1: int, deadline: float) -> tuple[int, int] | None:
+    # walks the edit graph from both ends at once and returns a point on the
+    # shortest path where they meet. only two diagonals arrays, so O(n + m) memory
+    n = a1 - a0
+    m = b1 - b0
+    max_d = (n + m + 1) // 2
+    offset = max_d
+    size = 2 * max_d + 2
+    forward = [-1] * size
+    backward = [-1] * size
+    forward[offset + 1] = 0
+    backward[offset + 1] = 0
+    delta = n - m
+    front = delta & 1
+    k1start = k1end = k2start = k2end = 0
+    for d in range(max_d):
+        if time.monotonic() > deadline:
+            return None
+        for k1 in range(-d + k1start, d + 1 - k1end, 2):
+            k1_offset = offset + k1
+            if k1 == -d or (k1 != d and forward[k1_offset - 1] < forward[k1_offset + 1]):
+                x1 = forward[k1_offset + 1]
+            else:
+                x1 = forward[k1_offset - 1] + 1
+            y1 = x1 - k1
+            while x1 < n and y1 < m and a[a0 + x1] == b[b0 + y1]:
+                x1 += 1
+                y1 += 1
+            forward[k1_offset] = x1
+            if x1 > n:
+                k1end += 2
+            elif y1 > m:
+                k1start += 2
+            elif front:
+                k2_offset = offset + delta - k1
+                if 0 <= k2_offset < size and backward[k2_offset] != -1 and x1 >= n - backward[k2_offset]:
+                    return a0 + x1, b0 + y1
+        for k2 in range(-d + k2start, d + 1 - k2end, 2):
+            k2_offset = offset + k2
+            if k2 == -d or (k2 != d and backward[k2_offset - 1] < backward[k2_offset + 1]):
+                x2 = backward[k2_offset + 1]
+            else:
+                x2 = backward[k2_offset - 1] + 1
+            y2 = x2 - k2
+            while x2 < n and y2 < m and a[a1 - 1 - x2] == b[b1 - 1 - y2]:
+                x2 += 1
+                y2 += 1
+            backward[k2_offset] = x2
+            if x2 > n:
+                k2end += 2
+            elif y2 > m:
+                k2start += 2
+            elif not front:
+                k1_offset = offset + delta - k2
+                if 0 <= k1_offset < size and forward[k1_offset] != -1:
+                    x1 = forward[k1_offset]
+                    if x1 >= n - x2:
+                        return a0 + x1, b0 + x1 - (k1_offset - offset)
+    # nothing in common
+    return None
+
+def _run_length(a: list, b: list, i: int, j: int, limit: int, step: int) -> int:
+    # equal items from (i, j) on, walking forward (step 1) or back from before it (step -1).
+    # whole blocks are compared as slices first, which runs in C
+    k = 0
+    block = 64
+    if step > 0:
+        while k + block <= limit and a[i + k:i + k + block] == b[j + k:j + k + block]:
+            k += block
+        while k < limit and a[i + k] == b[j + k]:
+            k += 1
+    else:
+        while k + block <= limit and a[i - k - block:i - k] == b[j - k - block:j - k]:
+            k += block
+        while k < limit and a[i - k - 1] == b[j - k - 1]:
+            k += 1
+    return k
+
+def diff_opcodes(a: list, b: list, deadline: float = None) -> tuple[list[tuple], bool]:
+    # same opcodes as SequenceMatcher.get_opcodes, plus False when the deadline cut
+    # the search short. the opcodes are still exact then, just coarser
+    if deadline is None:
+        deadline = time.monotonic() + DIFF_TIME_LIMIT
+    # ints compare faster than strings in the inner loops, equal items get the same id
+    ids = {}
+    counter = itertools.count()
+    a = list(map(ids.setdefault, a, counter))
+    b = list(map(ids.setdefault, b, counter))
+    n, m = len(a), len(b)
+    # (i, j, length) of equal runs
+    runs = []
+    prefix = _run_length(a, b, 0, 0, min(n, m), 1)
+    suffix = _run_length(a, b, n, m, min(n, m) - prefix, -1)
+    runs.append((0, 0, prefix))
+    runs.append((n - suffix, m - suffix, suffix))
+
+    regions = []
+    i, j = prefix, prefix
+    for anchor_i, anchor_j in _patience_anchors(a[prefix:n - suffix], b[prefix:m - suffix]):
+        anchor_i += prefix
+        anchor_j += prefix
+        regions.append((i, anchor_i, j, anchor_j))
+        runs.append((anchor_i, anchor_j, 1))
+        i, j = anchor_i + 1, anchor_j + 1
+    regions.append((i, n - suffix, j, m - suffix))
+
+    complete = True
+    while regions:
+        a0, a1, b0, b1 = regions.pop()
+        k = _run_length(a, b, a0, b0, min(a1 - a0, b1 - b0), 1)
+        runs.append((a0, b0, k))
+        a0 += k
+        b0 += k
+        k = _run_length(a, b, a1, b1, min(a1 - a0, b1 - b0), -1)
+        a1 -= k
+        b1 -= k
+        runs.append((a1, b1, k))
+        if a0 == a1 or b0 == b1:
+            continue
+        split = _myers_split(a, b, a0, a1, b0, b1, deadline) if complete else None
+        if split is None or split in ((a0, b0), (a1, b1)):
+            # left as one replace block
+            if time.monotonic() > deadline:
+                complete = False
+            continue
+        regions.append((a0, split[0], b0, split[1]))
+        regions.append((split[0], a1, split[1], b1))
+
+    runs = sorted(run for run in runs if run[2])
+    opcodes = []
+    i = j = 0
+    for ri, rj, length in runs + [(n, m, 0)]:
+        if ri > i or rj > j:
+            tag = "replace" if ri > i and rj > j else "delete" if ri > i else "insert"
+            opcodes.append((tag, i, ri, j, rj))
+        if length:
+            if opcodes and opcodes[-1][0] == "equal":
+                opcodes[-1] = ("equal", opcodes[-1][1], ri + length, opcodes[-1][3], rj + length)
+            else:
+                opcodes.append(("equal", ri, ri + length, rj, rj + length))
+        i, j = ri + length, rj + length
+    return opcodes, complete
+
+def group_opcodes(opcodes: list[tuple], context: int = DIFF_CONTEXT):
+    # hunks with context around them, like SequenceMatcher.get_grouped_opcodes
+    codes = list(opcodes) or [("equal", 0, 1, 0, 1)]
+    if codes[0][0] == "equal":
+        tag, i1, i2, j1, j2 = codes[0]
+        codes[0] = tag, max(i1, i2 - context), i2, max(j1, j2 - context), j2
+    if codes[-1][0] == "equal":
+        tag, i1, i2, j1, j2 = codes[-1]
+        codes[-1] = tag, i1, min(i2, i1 + context), j1, min(j2, j1 + context)
+    group = []
+    for tag, i1, i2, j1, j2 in codes:
+        if tag == "equal" and i2 - i1 > context * 2:
+            group.append((tag, i1, min(i2, i1 + context), j1, min(j2, j1 + context)))
+            yield group
+            group = []
+            i1, j1 = max(i1, i2 - context), max(j1, j2 - context)
+        group.append((tag, i1, i2, j1, j2))
+    if group and not (len(group) == 1 and group[0][0] == "equal"):
+        yield group
+
+def _hunk_range(start: int, stop: int) -> str:
+    length = stop - start
+    if length == 1:
+        return f"{start + 1}"
+    return f"{start + 1 if length else start},{length}"
+
+def clip_line(line: str) -> str:
+    if len(line) <= DIFF_MAX_LINE_CHARS:
+        return line
+    return f"{line[:DIFF_MAX_LINE_CHARS]}... ({len(line) - DIFF_MAX_LINE_CHARS} more chars)"
+
+def _common_ends(old: str, new: str) -> tuple[int, int]:
+    # lengths of the shared prefix and suffix, found by bisecting slice compares
+    limit = min(len(old), len(new))
+    lo, hi = 0, limit
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if old[:mid] == new[:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    prefix = lo
+    lo, hi = 0, limit - prefix
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if old[len(old) - mid:] == new[len(new) - mid:]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return prefix, lo
+
+def _show_span(text: str) -> str:
+    return clip_line(text.replace("\r", "\\r").replace("\n", "\\n"))
+
+def _range_diff(old: str, new: str, note: str) -> list[tuple[str, str]]:
+    prefix, suffix = _common_ends(old, new)
+    return [
+        (note, "header"),
+        (f"@@ chars {prefix}-{len(old) - suffix} -> {prefix}-{len(new) - suffix} @@", "header"),
+        (f"-{_show_span(old[prefix:len(old) - suffix])}", "removed"),
+        (f"+{_show_span(new[prefix:len(new) - suffix])}", "added"),
+    ]
+
+def _token_diff(old: str, new: str, deadline: float) -> list[tuple[str, str]] | None:
+    old_tokens = TOKEN_RE.findall(old)
+    new_tokens = TOKEN_RE.findall(new)
+    opcodes, complete = diff_opcodes(old_tokens, new_tokens, deadline)
+    if not complete:
+        return None
+    # char offset of every token, for the hunk headers
+    old_offsets = [0, *itertools.accumulate(map(len, old_tokens))]
+    new_offsets = [0, *itertools.accumulate(map(len, new_tokens))]
+    lines = [("(long lines, diffed by token)", "header")]
+    for group in group_opcodes(opcodes, DIFF_TOKEN_CONTEXT):
+        i1, i2, j1, j2 = group[0][1], group[-1][2], group[0][3], group[-1][4]
+        lines.append((f"@@ chars {old_offsets[i1]}-{old_offsets[i2]} -> {new_offsets[j1]}-{new_offsets[j2]} @@", "header"))
+        lines.append((f"-{_show_span(''.join(old_tokens[i1:i2]))}", "removed"))
+        lines.append((f"+{_show_span(''.join(new_tokens[j1:j2]))}", "added"))
+    return lines
+
+def diff_texts(old: str, new: str, fromfile: str, tofile: str) -> list[tuple[str, str]]:
+    # (line, tag) pairs, unified diff for normal files and per token or per
+    # changed range for minified ones
+    deadline = time.monotonic() + DIFF_TIME_LIMIT
+    if len(old) + len(new) > DIFF_MAX_CHARS:
+        return _range_diff(old, new, "(file too large for a full diff, showing the changed range)")
+    old_lines = old.splitlines()
+    new_lines = new.splitlines()
+    if max(map(len, old_lines + new_lines), default=0) > MINIFIED_LINE_CHARS:
+        return _token_diff(old, new, deadline) or _range_diff(old, new, "(diff took too long, showing the changed range)")
+
+    opcodes, complete = diff_opcodes(old_lines, new_lines, deadline)
+    lines = [(f"--- {fromfile}", "header"), (f"+++ {tofile}", "header")]
+    if not complete:
+        lines.append(("(diff took too long, some changes are shown as whole blocks)", "header"))
+    for group in group_opcodes(opcodes):
+        i1, i2, j1, j2 = group[0][1], group[-1][2], group[0][3], group[-1][4]
+        lines.append((f"@@ -{_hunk_range(i1, i2)} +{_hunk_range(j1, j2)} @@", "header"))
+        for tag, i1, i2, j1, j2 in group:
+            if tag == "equal":
+                lines.extend((clip_line(f" {line}"), "") for line in old_lines[i1:i2])
+                continue
+            lines.extend((clip_line(f"-{line}"), "removed") for line in old_lines[i1:i2])
+            lines.extend((clip_line(f"+{line}"), "added") for line in new_lines[j1:j2])
+    return lines
+
+def get_diff_cache_path(old_digest: str, new_digest: str) -> Path:
+    return get_diffs_path() / old_digest[:2] / f"{old_digest[2:]}-{new_digest}"
+
+def load_cached_diff(old_digest: str, new_digest: str) -> list[tuple[str, str]] | None:
+    try:
+        data = get_diff_cache_path(old_digest, new_digest).read_bytes()
+        return [tuple(line) for line in json.loads(_decompress(data[:1], data[1:]))]
+    except Exception:
+        return None
+
+def save_cached_diff(old_digest: str, new_digest: str, lines: list[tuple[str, str]]):
+    codec, comp = _compressor()
+    payload = json.dumps(lines, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    write_atomic(get_diff_cache_path(old_digest, new_digest), codec + comp.compress(payload) + comp.flush())
+
+def cached_diff_texts(old_digest: str, new_digest: str, old: str, new: str, fromfile: str, tofile: str) -> list[tuple[str, str]]:
+    # both versions are content addressed, so the diff between them never changes
+    lines = load_cached_diff(old_digest, new_digest)
+    if lines is None:
+        lines = diff_texts(old, new, fromfile, tofile)
+        try:
+            save_cached_diff(old_digest, new_digest, lines)
+        except OSError:
+            pass
+    return lines
+
 #####################
 # differ
+# diffs are computed off the tk thread only when a file is opened, and shown a page at a time
+
+# lines inserted into the text widget per page
+DIFF_PAGE_LINES = 2000
+
+def resolve_changed_file(server_info: dict, server_name: str, file_path: str) -> Path | None:
+    info = server_info.get(server_name)
+    if not info:
+        return None
+    server_path = info["path"]
+    if info["is_file"]:
+        # for single file servers ===> server_path IS the file
+        return server_path if file_path == server_path.name else server_path.parent / file_path
+    return server_path / file_path
+
+def compute_file_diff(server_name: str, file_path: str, kind: str, file_changes: dict, server_info: dict) -> list[tuple[str, str]]:
+    # (line, tag) pairs for one changed file, safe to run off the tk thread
+    old_digest = file_changes.get("old_digests", {}).get(file_path)
+    old_content = get_file_snapshot(server_name, file_path, old_digest) if kind != "added" else None
+    # the version the check saw is in the store, disk is only a fallback
+    new_digest = file_changes.get("new_digests", {}).get(file_path)
+    new_content = get_file_snapshot(server_name, file_path, new_digest) if new_digest and kind != "removed" else None
+    if new_content is None:
+        new_digest = None
+        full_path = resolve_changed_file(server_info, server_name, file_path) if kind != "removed" else None
+        if full_path and full_path.exists():
+            try:
+                new_content = full_path.read_text(encoding='utf-8', errors='replace')
+            except Exception:
+                pass
+
+    if kind == "added":
+        if new_content is None:
+            return [("(file is gone)", "")]
+        return [(clip_line(f"+{line}"), "added") for line in new_content.splitlines()]
+    if kind == "removed":
+        if old_content is None:
+            return [("(Unable to show removed file - snapshot not available)", "")]
+        return [(clip_line(f"-{line}"), "removed") for line in old_content.splitlines()]
+    if old_content is None or new_content is None:
+        return [("(Unable to generate diff - snapshot not available)", "")]
+
+    fromfile = f"old/{file_path}"
+    tofile = f"new/{file_path}"
+    if new_digest:
+        return cached_diff_texts(old_digest, new_digest, old_content, new_content, fromfile, tofile)
+    return diff_texts(old_content, new_content, fromfile, tofile)
 
 def show_diff_viewer(changes: dict, config_path: Path):
-    server_paths = get_server_paths(config_path) if config_path else {}
-    root = tk.Tk()
+    with metrics.phase("tk_startup"):
+        import tkinter as tk
+        from tkinter import ttk, messagebox
+        root = tk.Tk()
+    server_info = get_server_paths(config_path) if config_path else {}
     root.title("ClaudeDefender Review")
     root.geometry("900x600")
     root.configure(bg="#1E1E1E")
@@ -441,6 +3766,7 @@ def show_diff_viewer(changes: dict, config_path: Path):
     add_color = "#4EC9B0"
     remove_color = "#F14C4C"
     header_color = "#569CD6"
+    risk_color = "#FFB86C"
     
     main = tk.Frame(root, bg=bg_dark)
     main.pack(fill="both", expand=True, padx=10, pady=10)
@@ -461,6 +3787,10 @@ def show_diff_viewer(changes: dict, config_path: Path):
     
     notebook = ttk.Notebook(main)
     notebook.pack(fill="both", expand=True)
+
+    # one worker, results come back through a queue the tk loop polls
+    worker = ThreadPoolExecutor(max_workers=1)
+    results = queue.Queue()
     
     # changes tab
     if changes.get("config_changed"):
@@ -476,24 +3806,81 @@ def show_diff_viewer(changes: dict, config_path: Path):
             borderwidth=0
         )
         config_text.pack(fill="both", expand=True)
+        config_text.tag_configure("added", foreground=add_color)
+        config_text.tag_configure("removed", foreground=remove_color)
+        config_text.tag_configure("header", foreground=header_color, font=("Consolas", 10, "bold"))
         config_text.insert("1.0", "Config file (claude_desktop_config.json) was modified.\n\n")
-        config_text.insert("end", f"Servers configured: {changes.get('config_summary', 'Unknown')}\n")
+        config_text.insert("end", f"Servers configured: {changes.get('config_summary', 'Unknown')}\n\n")
+        config_diff = changes.get("config_diff")
+        if config_diff is None:
+            config_text.insert("end", "(no earlier config to compare against)\n")
+        elif not any(config_diff.values()):
+            config_text.insert("end", "No mcpServers entry changed, only formatting or other settings.\n")
+        else:
+            for name, fields in config_diff["added"].items():
+                config_text.insert("end", f"+ {name} (new server)\n", "header")
+                for field, value in fields.items():
+                    config_text.insert("end", f"+   {field}: {json.dumps(value)}\n", "added")
+            for name in config_diff["removed"]:
+                config_text.insert("end", f"- {name} (removed)\n", "header")
+            for name, field_changes in config_diff["edited"].items():
+                config_text.insert("end", f"~ {name}\n", "header")
+                for field, old_value, new_value in field_changes:
+                    if old_value is not None:
+                        config_text.insert("end", f"-   {field}: {json.dumps(old_value)}\n", "removed")
+                    if new_value is not None:
+                        config_text.insert("end", f"+   {field}: {json.dumps(new_value)}\n", "added")
         config_text.config(state="disabled")
-    
-    # individual server tab
-    server_changes = changes.get("server_changes", {})
-    for server_name, file_changes in server_changes.items():
-        server_frame = tk.Frame(notebook, bg=bg_dark)
-        notebook.add(server_frame, text=f"📦 {server_name}")
-        
-        text_scroll = tk.Scrollbar(server_frame)
+
+    def build_server_tab(server_frame, server_name, file_changes):
+        # file list on the left, diff of the selected file on the right
+        entries = (
+            [("added", f) for f in file_changes.get("added", [])]
+            + [("removed", f) for f in file_changes.get("removed", [])]
+            + [("modified", f) for f in file_changes.get("modified", [])]
+        )
+        # packed first so the diff pane cannot squeeze it out
+        action_bar = tk.Frame(server_frame, bg=bg_dark)
+        action_bar.pack(side="bottom", fill="x", pady=(6, 0))
+        panes = tk.PanedWindow(server_frame, orient="horizontal", bg=bg_dark, sashwidth=4, bd=0)
+        panes.pack(fill="both", expand=True)
+
+        list_frame = tk.Frame(panes, bg=bg_dark)
+        list_scroll = tk.Scrollbar(list_frame)
+        list_scroll.pack(side="right", fill="y")
+        file_list = tk.Listbox(
+            list_frame,
+            bg=bg_medium,
+            fg=text_color,
+            font=("Consolas", 10),
+            borderwidth=0,
+            highlightthickness=0,
+            activestyle="none",
+            exportselection=False,
+            yscrollcommand=list_scroll.set
+        )
+        file_list.pack(fill="both", expand=True)
+        list_scroll.config(command=file_list.yview)
+        markers = {"added": "+", "removed": "-", "modified": "~"}
+        risk = file_changes.get("risk", {})
+        file_list.insert("end", *(
+            f"{markers[kind]} {f}" + (f"  [{risk[f]['level']} {risk[f]['score']}]" if f in risk else "")
+            for kind, f in entries
+        ))
+        for i, (kind, f) in enumerate(entries):
+            if f in risk and risk[f]["level"] != "low":
+                file_list.itemconfig(i, fg=risk_color)
+            elif kind != "modified":
+                file_list.itemconfig(i, fg=add_color if kind == "added" else remove_color)
+        panes.add(list_frame, width=280)
+
+        text_frame = tk.Frame(panes, bg=bg_dark)
+        text_scroll = tk.Scrollbar(text_frame)
         text_scroll.pack(side="right", fill="y")
-        
-        h_scroll = tk.Scrollbar(server_frame, orient="horizontal")
+        h_scroll = tk.Scrollbar(text_frame, orient="horizontal")
         h_scroll.pack(side="bottom", fill="x")
-        
         text_widget = tk.Text(
-            server_frame,
+            text_frame,
             bg=bg_medium,
             fg=text_color,
             font=("Consolas", 10),
@@ -505,68 +3892,148 @@ def show_diff_viewer(changes: dict, config_path: Path):
         text_widget.pack(fill="both", expand=True)
         text_scroll.config(command=text_widget.yview)
         h_scroll.config(command=text_widget.xview)
-        
         text_widget.tag_configure("added", foreground=add_color)
         text_widget.tag_configure("removed", foreground=remove_color)
         text_widget.tag_configure("header", foreground=header_color, font=("Consolas", 10, "bold"))
-        
-        server_info = get_server_paths(config_path) if config_path else {}
-        server_path = None
-        is_single_file = False
-        
-        if server_name in server_info:
-            server_path = server_info[server_name]["path"]
-            is_single_file = server_info[server_name]["is_file"]
-        
-        for f in file_changes.get("added", []):
-            text_widget.insert("end", f"\n+ ADDED: {f}\n", "added")
-        for f in file_changes.get("removed", []):
-            text_widget.insert("end", f"\n- REMOVED: {f}\n", "removed")
-        for f in file_changes.get("modified", []):
-            text_widget.insert("end", f"\n{'='*60}\n", "header")
-            text_widget.insert("end", f"MODIFIED: {f}\n", "header")
-            text_widget.insert("end", f"{'='*60}\n\n", "header")
-            
-            old_content = get_file_snapshot(server_name, f)
-            new_content = None
-            
-            if server_path:
-                if is_single_file:
-                    # for single file servers ===> server_path IS the file
-                    if f == server_path.name:
-                        full_path = server_path
-                    else:
-                        full_path = server_path.parent / f
+        text_widget.tag_configure("more", foreground=header_color, underline=True)
+        text_widget.tag_configure("risk", foreground=risk_color)
+        text_widget.insert("end", f"{len(entries)} changed file(s), pick one on the left.\n")
+        text_widget.config(state="disabled")
+        panes.add(text_frame)
+
+        view = {"request": 0, "lines": [], "shown": 0}
+
+        def show_page():
+            lines = view["lines"]
+            page = lines[view["shown"]:view["shown"] + DIFF_PAGE_LINES]
+            view["shown"] += len(page)
+            text_widget.config(state="normal")
+            text_widget.delete("more.first", "more.last") if text_widget.tag_ranges("more") else None
+            # one insert call per page, runs of the same tag merged
+            args = []
+            for line, tag in page:
+                if args and args[-1] == tag:
+                    args[-2] += line + "\n"
                 else:
-                    full_path = server_path / f
-                    
-                if full_path.exists():
-                    try:
-                        new_content = full_path.read_text(encoding='utf-8', errors='replace')
-                    except:
-                        pass
-            
-            if old_content and new_content:
-                # gen diff
-                diff = difflib.unified_diff(
-                    old_content.splitlines(keepends=True),
-                    new_content.splitlines(keepends=True),
-                    fromfile=f"old/{f}",
-                    tofile=f"new/{f}",
-                    lineterm=""
-                )
-                
-                for line in diff:
-                    if line.startswith('+') and not line.startswith('+++'):
-                        text_widget.insert("end", line + "\n", "added")
-                    elif line.startswith('-') and not line.startswith('---'):
-                        text_widget.insert("end", line + "\n", "removed")
-                    else:
-                        text_widget.insert("end", line + "\n")
+                    args += [line + "\n", tag]
+            if args:
+                text_widget.insert("end", *args)
+            remaining = len(lines) - view["shown"]
+            if remaining > 0:
+                text_widget.insert("end", f"... {remaining} more line(s), click to show\n", "more")
+            text_widget.config(state="disabled")
+
+        text_widget.tag_bind("more", "<Button-1>", lambda e: show_page())
+        text_widget.tag_bind("more", "<Enter>", lambda e: text_widget.config(cursor="hand2"))
+        text_widget.tag_bind("more", "<Leave>", lambda e: text_widget.config(cursor=""))
+
+        def on_select(event):
+            selection = file_list.curselection()
+            if not selection:
+                return
+            kind, f = entries[selection[0]]
+            view["request"] += 1
+            request = view["request"]
+            text_widget.config(state="normal")
+            text_widget.delete("1.0", "end")
+            text_widget.insert("end", f"{kind.upper()}: {f}", "header")
+            if f in risk:
+                # same line, the diff below replaces everything from line 3
+                text_widget.insert("end", f"   {risk[f]['level']} risk {risk[f]['score']}: {', '.join(risk[f]['findings'])}", "risk")
+            text_widget.insert("end", "\n\ncomputing diff...\n")
+            text_widget.config(state="disabled")
+            future = worker.submit(compute_file_diff, server_name, f, kind, file_changes, server_info)
+            future.add_done_callback(lambda fut: results.put((show_result, request, fut)))
+
+        def show_result(request, future):
+            # a newer selection replaced this one
+            if request != view["request"]:
+                return
+            try:
+                view["lines"] = future.result()
+            except Exception as e:
+                view["lines"] = [(f"(Unable to generate diff - {e})", "")]
+            view["shown"] = 0
+            text_widget.config(state="normal")
+            text_widget.delete("3.0", "end")
+            text_widget.config(state="disabled")
+            show_page()
+
+        file_list.bind("<<ListboxSelect>>", on_select)
+
+        def run_action(label, action):
+            # the selected file, else every pending change of the server. quarantine takes the whole server
+            selection = file_list.curselection()
+            files = [entries[selection[0]][1]] if selection and action is not quarantine else []
+            if action is revert_changes:
+                question = f"Restore {files[0] if files else f'every pending change of {server_name}'} from snapshots? Current versions are backed up first."
+            elif action is quarantine:
+                question = f"Move {server_name} to quarantinedMcpServers? Claude will not start it until it is released."
             else:
-                text_widget.insert("end", "(Unable to generate diff - snapshot not available)\n")
-        
-        text_widget.config(state="disabled")
+                question = None
+            if question and not messagebox.askyesno(label, question, parent=root):
+                return
+            status.config(text=f"{label}...", fg=text_color)
+            future = worker.submit(action, server_name, files)
+            future.add_done_callback(lambda fut: results.put((show_action, label, fut)))
+
+        def show_action(label, future):
+            try:
+                done = future.result()
+            except (RuntimeError, OSError, KeyError) as e:
+                status.config(text=f"{label} failed: {e}", fg=remove_color)
+                return
+            if isinstance(done, Path):
+                status.config(text=f"{label} done, backup in {done.name}", fg=add_color)
+            else:
+                count = sum(len(files) for files in done.values())
+                status.config(text=f"{label}: {count} file(s)" if count else "Nothing pending", fg=add_color if count else text_color)
+
+        for label, action in (("Accept", accept_changes), ("Revert", revert_changes), ("Quarantine server", quarantine)):
+            tk.Button(
+                action_bar,
+                text=label,
+                font=("Segoe UI", 9),
+                fg=text_color,
+                bg=bg_medium,
+                activebackground="#3E3E3E",
+                activeforeground=text_color,
+                bd=0,
+                padx=12,
+                pady=3,
+                cursor="hand2",
+                command=lambda label=label, action=action: run_action(label, action)
+            ).pack(side="left", padx=(0, 6))
+        status = tk.Label(action_bar, text="", font=("Segoe UI", 9), fg=text_color, bg=bg_dark)
+        status.pack(side="left", padx=(6, 0))
+    
+    # individual server tab, filled the first time it is shown
+    server_changes = changes.get("server_changes", {})
+    pending_tabs = {}
+    for server_name, file_changes in server_changes.items():
+        server_frame = tk.Frame(notebook, bg=bg_dark)
+        notebook.add(server_frame, text=f"📦 {server_name}")
+        pending_tabs[str(server_frame)] = (server_frame, server_name, file_changes)
+
+    def on_tab_changed(event):
+        tab = pending_tabs.pop(notebook.select(), None)
+        if tab:
+            build_server_tab(*tab)
+
+    notebook.bind("<<NotebookTabChanged>>", on_tab_changed)
+
+    def poll_results():
+        while True:
+            try:
+                handler, *payload = results.get_nowait()
+            except queue.Empty:
+                break
+            handler(*payload)
+        root.after(50, poll_results)
+
+    def close():
+        worker.shutdown(wait=False, cancel_futures=True)
+        root.destroy()
     
     close_btn = tk.Button(
         main,
@@ -580,59 +4047,546 @@ def show_diff_viewer(changes: dict, config_path: Path):
         padx=20,
         pady=5,
         cursor="hand2",
-        command=root.destroy
+        command=close
     )
     close_btn.pack(pady=(10, 0))
+    root.protocol("WM_DELETE_WINDOW", close)
+    root.after(50, poll_results)
     
     root.mainloop()
 
 
+#####################
+# content scan
+# added and modified files are looked at for what tool poisoning looks like: instructions
+# aimed at the model, new network and exec calls, obfuscated blobs. one aho-corasick pass
+# finds every phrase, findings are cached by digest so a version is only ever read once
+
+# (rule, weight of each new hit, phrases), phrases match case insensitive
+CONTENT_RULES = (
+    ("hidden_instruction", 30, (
+        "ignore previous instructions", "ignore all previous", "disregard previous", "forget your instructions",
+        "do not tell the user", "don't tell the user", "do not mention", "without telling the user",
+        "the user must not", "do not disclose", "<important>", "<system>", "[system]",
+        "before using this tool", "before calling any", "you must first", "this is very important"
+    )),
+    ("secret_access", 25, (
+        "/.ssh/", "id_rsa", "id_ed25519", ".aws/credentials", ".npmrc", ".pypirc", ".netrc", ".git-credentials",
+        "claude_desktop_config.json", "private key", "keychain", "wallet.dat"
+    )),
+    ("exec", 15, (
+        "child_process", "execsync(", "spawnsync(", "execfile(", "eval(", "new function(", "os.system(", "os.popen(",
+        "subprocess.", "pty.spawn", "__import__(", "powershell", "/bin/sh", "cmd.exe", "| sh", "| bash"
+    )),
+    ("network", 10, (
+        "fetch(", "http.request(", "https.request(", "axios", "xmlhttprequest", "new websocket(", "net.connect(",
+        "dgram.", "requests.post(", "requests.get(", "urllib.request", "http.client", "socket.socket(", "curl ", "wget "
+    )),
+    ("obfuscation", 15, (
+        "atob(", "base64.b64decode", "b64decode(", "fromcharcode(", "codecs.decode(", "zlib.decompress(",
+        "marshal.loads(", "unescape(", "\\x65\\x76\\x61\\x6c"
+    )),
+)
+CONTENT_RULE_WEIGHTS = {rule: weight for rule, weight, _ in CONTENT_RULES}
+# a feature counts this many new hits at most, a file full of fetch( is not 50 times worse
+CONTENT_HIT_CAP = 3
+# past this only the head of a file is scanned
+CONTENT_SCAN_MAX_BYTES = 4 * 1024 * 1024
+# base64 and hex runs this long do not come from a person typing
+BLOB_RE = re.compile(r"[A-Za-z0-9+/]{200,}={0,2}|(?:\\x[0-9a-fA-F]{2}){16,}|[0-9a-fA-F]{256,}")
+# zero width, bidi and tag characters hide text from a reviewer but not from the model
+INVISIBLE_RE = re.compile("[\u200b-\u200f\u202a-\u202e\u2060-\u2064\u2066-\u2069\U000e0000-\U000e007f]")
+# lowest score of each level
+RISK_LEVELS = ((60, "high"), (25, "medium"), (1, "low"))
+# bump when an analyzer changes what it reports, cached findings are then redone
+CONTENT_SCAN_VERSION = 1
+
+class PhraseMatcher:
+    # aho-corasick automaton compiled down to a dfa: per state a dict of every char that
+    # leads somewhere other than the root, so matching is one dict lookup per char
+    __slots__ = ("phrases", "_delta", "_out")
+
+    def __init__(self, phrases):
+        self.phrases = list(dict.fromkeys(phrase.lower() for phrase in phrases))
+        goto = [{}]
+        out = [[]]
+        for index, phrase in enumerate(self.phrases):
+            state = 0
+            for ch in phrase:
+                nxt = goto[state].get(ch)
+                if nxt is None:
+                    nxt = goto[state][ch] = len(goto)
+                    goto.append({})
+                    out.append([])
+                state = nxt
+            out[state].append(index)
+        # breadth first, a state's fail state is always done before it
+        fail = [0] * len(goto)
+        delta = [None] * len(goto)
+        delta[0] = goto[0]
+        pending = deque(goto[0].values())
+        while pending:
+            state = pending.popleft()
+            delta[state] = {**delta[fail[state]], **goto[state]}
+            out[state] = out[state] + out[fail[state]]
+            for ch, nxt in goto[state].items():
+                fail[nxt] = delta[fail[state]].get(ch, 0)
+                pending.append(nxt)
+        self._delta = delta
+        self._out = [tuple(indexes) for indexes in out]
+
+    def count(self, text: str) -> dict[str, int]:
+        # phrase -> occurrences, overlapping ones included
+        delta = self._delta
+        out = self._out
+        hits = [0] * len(self.phrases)
+        state = 0
+        for ch in text.lower():
+            state = delta[state].get(ch, 0)
+            for index in out[state]:
+                hits[index] += 1
+        return {self.phrases[index]: n for index, n in enumerate(hits) if n}
+
+_content_matcher = None
+_content_rule_of = {}
+
+def phrase_findings(text: str) -> dict[str, int]:
+    global _content_matcher
+    if _content_matcher is None:
+        for rule, _, phrases in CONTENT_RULES:
+            for phrase in phrases:
+                _content_rule_of.setdefault(phrase.lower(), rule)
+        _content_matcher = PhraseMatcher(_content_rule_of)
+    return {f"{_content_rule_of[phrase]}: {phrase}": n for phrase, n in _content_matcher.count(text).items()}
+
+def blob_findings(text: str) -> dict[str, int]:
+    findings = {}
+    blobs = sum(1 for _ in BLOB_RE.finditer(text))
+    if blobs:
+        findings["obfuscation: encoded blob"] = blobs
+    invisible = len(INVISIBLE_RE.findall(text))
+    if invisible:
+        findings["hidden_instruction: invisible characters"] = invisible
+    return findings
+
+# each takes a file's text and returns {"rule: what": count}, rules outside CONTENT_RULES weigh 10.
+# append to add checks
+CONTENT_ANALYZERS = [phrase_findings, blob_findings]
+
+def content_rules_key() -> str:
+    # cached findings are only reused while the rules and analyzers are the same
+    spec = json.dumps([CONTENT_SCAN_VERSION, CONTENT_RULES, [analyzer.__name__ for analyzer in CONTENT_ANALYZERS]])
+    return hashlib.sha256(spec.encode()).hexdigest()[:16]
+
+def scan_content(data: bytes) -> dict[str, int]:
+    text = data[:CONTENT_SCAN_MAX_BYTES].decode("utf-8", errors="replace")
+    findings = {}
+    for analyzer in CONTENT_ANALYZERS:
+        for feature, n in analyzer(text).items():
+            findings[feature] = findings.get(feature, 0) + n
+    return findings
+
+def content_findings(digests: set[str]) -> dict[str, dict]:
+    # digest -> findings for every version the store has, scanned once and then cached
+    key = content_rules_key()
+    result = {}
+    with state_db() as db:
+        for digest in digests:
+            row = db.execute("SELECT findings FROM content_scan WHERE digest = ? AND rules = ?", (digest, key)).fetchone()
+            if row:
+                result[digest] = json.loads(row[0])
+    metrics.count("content_cache_hits", len(result))
+    scanned = []
+    for digest in digests - result.keys():
+        try:
+            data = get_object(digest)
+        except Exception:
+            data = None
+        if data is None:
+            continue
+        result[digest] = scan_content(data)
+        scanned.append((digest, key, json.dumps(result[digest])))
+    if scanned:
+        metrics.count("content_scanned", len(scanned))
+        with state_db() as db:
+            db.executemany("INSERT OR REPLACE INTO content_scan VALUES (?, ?, ?)", scanned)
+    return result
+
+def score_findings(new: dict, old: dict = None) -> tuple[int, list[str]]:
+    # only what the change brought in counts, hits beyond those of the old version
+    score = 0
+    notes = []
+    for feature, n in sorted(new.items()):
+        added = n - (old or {}).get(feature, 0)
+        if added <= 0:
+            continue
+        score += CONTENT_RULE_WEIGHTS.get(feature.partition(":")[0], 10) * min(added, CONTENT_HIT_CAP)
+        notes.append(f"{feature} (+{added})")
+    return min(score, 100), notes
+
+def risk_level(score: int) -> str | None:
+    for floor, level in RISK_LEVELS:
+        if score >= floor:
+            return level
+    return None
+
+def scan_changed_content(server_changes: dict):
+    # adds "risk" {path: {"score", "level", "findings"}} and "risk_score" to every server's
+    # changes. added and modified files only, a removal cannot poison anything
+    digests = set()
+    for file_changes in server_changes.values():
+        for f in file_changes["added"] + file_changes["modified"]:
+            digests.add(file_changes["new_digests"].get(f))
+        digests.update(file_changes["old_digests"].get(f) for f in file_changes["modified"])
+    digests.discard(None)
+    findings = content_findings(digests)
+    for file_changes in server_changes.values():
+        risk = {}
+        for kind in ("added", "modified"):
+            for f in file_changes[kind]:
+                new = findings.get(file_changes["new_digests"].get(f))
+                if new is None:
+                    continue
+                # an old version that is not in the store counts as empty
+                old = findings.get(file_changes["old_digests"].get(f)) if kind == "modified" else None
+                score, notes = score_findings(new, old)
+                if score:
+                    risk[f] = {"score": score, "level": risk_level(score), "findings": notes}
+        file_changes["risk"] = risk
+        file_changes["risk_score"] = max((r["score"] for r in risk.values()), default=0)
+
+def riskiest_change(changes_detail: dict) -> tuple[str, str, dict] | None:
+    # (server, path, risk) of the highest scoring file
+    best = None
+    for server_name, file_changes in changes_detail.get("server_changes", {}).items():
+        for f, risk in file_changes.get("risk", {}).items():
+            if best is None or risk["score"] > best[2]["score"]:
+                best = (server_name, f, risk)
+    return best
+
+def risk_summary(changes_detail: dict) -> str | None:
+    best = riskiest_change(changes_detail)
+    if best is None:
+        return None
+    server_name, f, risk = best
+    return f"{risk['level'].capitalize()} risk ({risk['score']}) in {server_name}/{f}: {', '.join(risk['findings'][:3])}"
+
 #####################
 # check for changes return summary based on detection
 
-def check_for_changes() -> tuple[bool, str, dict]:
+def check_for_changes(options: ScanOptions = None, touched: dict = None) -> tuple[bool, str, dict]:
+    # touched comes from a watcher, {"config": bool, "servers": {name: {rel paths}}}.
+    # without it, or when the config itself changed, every server is scanned
     config_path = get_config_path()
-    current_config_hash = file_hash(config_path)
-    summary = get_config_summary(config_path)
-    current_server_hashes = hash_all_servers(config_path)
-    
-    state = load_state()
+    # the old file rows are loaded after a full scan, not held through it
+    with metrics.phase("load_state"):
+        state = load_state(files=False)
     last_config_hash = state.get("last_hash")
+    # states written before hash_algo existed are md5
+    state_algo = state.get("hash_algo", LEGACY_HASH_ALGO) if state else None
+    if options is None:
+        options = ScanOptions(algo=state.get("hash_algo", DEFAULT_HASH_ALGO))
+
+    migrating = state_algo is not None and state_algo != options.algo
+    if migrating:
+        # algo switch, compare with the old algo once so nothing is flagged just for that
+        comparable_config_hash = file_hash(config_path, state_algo)
+        comparable_hashes = hash_all_servers(config_path, replace(options, algo=state_algo))
+
+    current_config_hash = file_hash(config_path, options.algo)
+    config = load_config(config_path)
+    summary = config.summary
+    incremental = (
+        touched is not None
+        and not touched["config"]
+        and not migrating
+        and current_config_hash == last_config_hash
+    )
+    # snapshots of changed files are written during this same pass
+    if incremental:
+        with metrics.phase("load_state"):
+            load_state_files(state)
+        with metrics.phase("hash_servers"):
+            current_server_hashes = rehash_touched(config_path, options, state["server_hashes"], touched["servers"])
+    else:
+        with metrics.phase("hash_servers"):
+            current_server_hashes = hash_all_servers(config_path, options, snapshot=True)
+        if state:
+            with metrics.phase("load_state"):
+                load_state_files(state)
     last_server_hashes = state.get("server_hashes", {})
+    last_server_trees = state.get("server_trees", {})
+
+    def trees_for(hashes):
+        # servers rehash_touched left alone are the same dicts, their trees are too
+        return {
+            name: last_server_trees[name] if files is last_server_hashes.get(name) and name in last_server_trees else build_merkle(files)
+            for name, files in hashes.items()
+        }
+
+    with metrics.phase("merkle"):
+        current_server_trees = trees_for(current_server_hashes)
+    if migrating:
+        comparable_trees = trees_for(comparable_hashes)
+    else:
+        comparable_config_hash = current_config_hash
+        comparable_hashes = current_server_hashes
+        comparable_trees = current_server_trees
     
-    config_changed = current_config_hash != last_config_hash
-    server_changes = compare_server_hashes(last_server_hashes, current_server_hashes)
+    config_changed = comparable_config_hash != last_config_hash
+    with metrics.phase("compare"):
+        server_changes = compare_server_hashes(last_server_hashes, comparable_hashes, last_server_trees, comparable_trees)
+    # the first check is the baseline, every file in it counts as added
+    if server_changes and options.content_scan and last_server_hashes:
+        with metrics.phase("content_scan"):
+            scan_changed_content(server_changes)
     
     any_changes = config_changed or bool(server_changes)
     changes_detail = {}
     if config_changed:
         changes_detail["config_changed"] = True
         changes_detail["config_summary"] = summary
+        # states from before config_fields cannot say what changed
+        if "config_fields" in state:
+            changes_detail["config_diff"] = diff_config_servers(state["config_fields"], config.fields)
     if server_changes:
         changes_detail["server_changes"] = server_changes
     messages = []
     if config_changed:
         messages.append("Config modified")
     if server_changes:
-        modified_servers = list(server_changes.keys())
+        modified_servers = [f"{name} ({server_fingerprint(current_server_trees.get(name))})" for name in server_changes]
         messages.append(f"Code changed in: {', '.join(modified_servers)}")
+    riskiest = riskiest_change(changes_detail)
+    if riskiest:
+        messages.append(f"{riskiest[2]['level'].capitalize()} risk in {riskiest[0]}/{riskiest[1]}")
     
     change_summary = " | ".join(messages) if messages else "No changes"
     
-    # save snapshots BEFORE updating state (so we can diff later)
-    # Only save if this isn't the first run
-    if last_config_hash is not None:
-        pass
-
+    state["hash_algo"] = options.algo
     state["last_hash"] = current_config_hash
     state["last_check"] = datetime.now().isoformat()
     state["last_summary"] = summary
+    state["config_fields"] = config.fields
     state["server_hashes"] = current_server_hashes
-    save_state(state)
-    save_all_snapshots(config_path)
+    state["server_trees"] = current_server_trees
+    # what accept and revert act on, merged with the pending changes as they are when this
+    # saves. old digests of a migration are not in the store, and a server new to the
+    # config has nothing to revert to
+    keys = CHECK_META_KEYS
+    reconcile = None
+    if last_server_hashes and not migrating:
+        known = {name: file_changes for name, file_changes in server_changes.items() if name in last_server_hashes}
+        keys += ("pending",)
+        reconcile = functools.partial(reconcile_pending, start_pending=state.get("pending", {}), server_changes=known)
+    with metrics.phase("save_state"):
+        save_state(state, last_server_hashes, last_server_trees, keys, reconcile)
     
     return any_changes, change_summary, changes_detail
 
+def quick_check(options: ScanOptions) -> tuple[bool, str, dict]:
+    # first phase: the config digest and what each server starts from (a single file server,
+    # the entry files of a tree) against the last state. reads a handful of files through
+    # the stat cache and writes nothing, the full check that follows confirms and records
+    config_path = get_config_path()
+    # only the meta rows, the file and stat cache rows of the entry files are looked up below
+    state = load_state(files=False)
+    if not state or state.get("hash_algo", LEGACY_HASH_ALGO) != options.algo:
+        # first run or an algo migration, only the full check can compare
+        return False, "No changes", {}
+    config_changed = file_hash(config_path, options.algo) != state.get("last_hash")
+    entries = {}
+    for name, info in get_server_paths(config_path).items():
+        root = info["path"]
+        if info["is_file"]:
+            entries[name] = [(root.name, root)]
+        else:
+            entries[name] = [(rel_path, root / rel_path) for rel_path in entry_candidates(root, rules=options.rules)]
+    with state_db() as db:
+        # a new server comes with a config change, its files are listed by the full check
+        entries = {
+            name: paths for name, paths in entries.items()
+            if db.execute("SELECT 1 FROM files WHERE server = ? LIMIT 1", (name,)).fetchone()
+        }
+        wanted = {name: [rel_path for rel_path, _ in paths] for name, paths in entries.items()}
+        old = _load_selected_rows(db, "files", "digest", wanted)
+        row = db.execute("SELECT value FROM meta WHERE key = 'cache_algo'").fetchone()
+        # digests from another algo are useless
+        cache = _load_selected_rows(db, "hash_cache", "size, mtime_ns, ino, ctime_ns, digest", wanted) if row and json.loads(row[0]) == options.algo else {}
+    new = {}
+    for name, paths in entries.items():
+        new[name] = {}
+        for rel_path, full_path in paths:
+            h = cached_file_hash(full_path, rel_path, cache.get(name, {}), {}, options.paranoid, options.algo)
+            if h:
+                new[name][rel_path] = h
+    server_changes = compare_server_hashes(old, new)
+    changes_detail = {}
+    messages = []
+    if config_changed:
+        changes_detail["config_changed"] = True
+        changes_detail["config_summary"] = load_config(config_path).summary
+        messages.append("Config modified")
+    if server_changes:
+        changes_detail["server_changes"] = server_changes
+        messages.append(f"Entry files changed in: {', '.join(server_changes)}")
+    return bool(messages), " | ".join(messages) if messages else "No changes", changes_detail
+
+class FullCheck(threading.Thread):
+    # second phase on a worker thread, so the overlay of the first one stays responsive.
+    # the result also goes to updates, in the form show_overlay takes
+    def __init__(self, options: ScanOptions, touched: dict = None):
+        super().__init__(name="full-check")
+        self.options = options
+        self.touched = touched
+        self.updates = queue.Queue()
+        self.result = None
+        self.error = None
+
+    def run(self):
+        try:
+            with metrics.phase("check"):
+                self.result = check_for_changes(self.options, self.touched)
+            _, summary, changes_detail = self.result
+            self.updates.put({"message": summary, "changes": changes_detail, "done": True})
+        except Exception as e:
+            self.error = e
+            self.updates.put({"message": f"Audit failed: {e}", "done": True})
+
+def overlay_while_auditing(quick: tuple, options: ScanOptions, duration: int, config_path: Path, touched: dict = None) -> tuple[bool, str, dict]:
+    # in-process ui: the overlay shows what the quick phase found and is updated when
+    # the full check is done. returns the full result
+    audit = FullCheck(options, touched)
+    audit.start()
+    try:
+        show_overlay(
+            "MCP Changes Detected",
+            quick[1],
+            duration,
+            changes=quick[2],
+            config_path=config_path,
+            updates=audit.updates
+        )
+    finally:
+        audit.join()
+    if audit.error:
+        raise audit.error
+    return audit.result
+
+
+#####################
+# reports
+# machine readable records, one per server and per changed file, written as they are made
+
+EXIT_CLEAN = 0
+EXIT_CHANGED = 1
+# 2 is argparse's usage error
+EXIT_ERROR = 3
+
+def iso_time(ns: int) -> str:
+    return datetime.fromtimestamp(ns / 1e9).isoformat()
+
+def change_records(changed: bool, summary: str, changes_detail: dict, config_path: Path, profile: str = None, phase: str = None):
+    # config, then per server a server record followed by its files, then one summary.
+    # records of the quick phase are tagged with it, the full check's records follow them
+    checked = datetime.now().isoformat()
+    base = {"profile": profile} if profile else {}
+    if phase:
+        base["phase"] = phase
+    if changes_detail.get("config_changed"):
+        yield {
+            **base,
+            "type": "config",
+            "path": str(config_path),
+            "summary": changes_detail.get("config_summary"),
+            "diff": changes_detail.get("config_diff"),
+            "checked": checked
+        }
+    server_changes = changes_detail.get("server_changes", {})
+    server_info = get_server_paths(config_path) if server_changes else {}
+    for server_name, file_changes in server_changes.items():
+        yield {
+            **base,
+            "type": "server",
+            "server": server_name,
+            "added": len(file_changes["added"]),
+            "removed": len(file_changes["removed"]),
+            "modified": len(file_changes["modified"]),
+            "fingerprint": file_changes.get("fingerprint"),
+            "package": server_info.get(server_name, {}).get("package"),
+            "risk": file_changes.get("risk_score"),
+            "checked": checked
+        }
+        for kind in ("added", "removed", "modified"):
+            for f in file_changes[kind]:
+                risk = file_changes.get("risk", {}).get(f, {})
+                record = {
+                    **base,
+                    "type": "file",
+                    "server": server_name,
+                    "path": f,
+                    "change": kind,
+                    "old_digest": file_changes.get("old_digests", {}).get(f),
+                    "new_digest": file_changes.get("new_digests", {}).get(f),
+                    "size": None,
+                    "mtime": None,
+                    "risk": risk.get("score", 0 if "risk" in file_changes else None),
+                    "findings": risk.get("findings", [])
+                }
+                full_path = resolve_changed_file(server_info, server_name, f) if kind != "removed" else None
+                try:
+                    st = full_path.stat() if full_path else None
+                except OSError:
+                    st = None
+                if st:
+                    record["size"] = st.st_size
+                    record["mtime"] = iso_time(st.st_mtime_ns)
+                yield record
+    yield {**base, "type": "summary", "changed": changed, "summary": summary, "checked": checked}
+
+class RecordWriter:
+    # ndjson is a line per record, json one array streamed element by element
+    def __init__(self, fmt: str, out=None):
+        self.fmt = fmt
+        self.out = out or sys.stdout
+        self.count = 0
+
+    def write(self, record: dict):
+        data = json.dumps(record, default=str)
+        if self.fmt == "json":
+            data = ("[\n" if not self.count else ",\n") + data
+        else:
+            data += "\n"
+        self.out.write(data)
+        self.count += 1
+        if self.fmt == "ndjson":
+            # log shippers tail this, a record must not sit in the buffer
+            self.out.flush()
+
+    def close(self):
+        if self.fmt == "json":
+            self.out.write("\n]\n" if self.count else "[]\n")
+        self.out.flush()
+
+def check_fleet(profiles: list[tuple[str, Path, Path, Path | None]], options: ScanOptions, excludes: list[str] = (), includes: list[str] = (), algo: str = None):
+    # profiles are (label, config path, state dir, home dir). each keeps its own state and
+    # snapshots, server trees several of them point at are hashed once.
+    # a profile that fails yields changed=None and the error as summary
+    shared = {}
+    for label, config_path, state_dir, home in profiles:
+        with use_profile(config_path, state_dir, home):
+            try:
+                profile_options = replace(
+                    options,
+                    algo=algo or get_state_meta("hash_algo", DEFAULT_HASH_ALGO),
+                    rules=load_ignore_rules(excludes, includes),
+                    shared=shared
+                )
+                result = check_for_changes(profile_options)
+            except Exception as e:
+                result = None, f"{type(e).__name__}: {e}", {}
+        yield label, config_path, *result
+
 
 ######################
 ######################
@@ -641,14 +4595,202 @@ def main():
     parser = argparse.ArgumentParser(description="Monitor MCP config for Claude Desktop")
     parser.add_argument("--watch", action="store_true", help="Wait for Claude startup and monitor")
     parser.add_argument("--once", action="store_true", help="Check once immediately (default)")
+    parser.add_argument("--daemon", action="store_true", help="Like --watch but headless, changes only go to attached --ui clients")
+    parser.add_argument("--ui", action="store_true", help="Attach to a running --watch/--daemon and show its overlays")
+    parser.add_argument("--status", action="store_true", help="Print the status of a running --watch/--daemon")
     parser.add_argument("--overlay-test", action="store_true", help="Test the overlay window")
     parser.add_argument("--diff-test", action="store_true", help="Test the diff viewer")
     parser.add_argument("--duration", type=int, default=8000, help="Overlay duration in ms")
     # recommended to run once after install
     parser.add_argument("--init", action="store_true", help="Initialize snapshots without alerting")
+    parser.add_argument("--gc", action="store_true", help="Prune snapshot objects no manifest references and exit")
+    parser.add_argument("--history", nargs="+", metavar=("SERVER", "FILE"), help="List snapshot generations of a server, or of one of its files")
+    parser.add_argument("--diff-gen", nargs=4, metavar=("SERVER", "FILE", "A", "B"), help="Diff two generations of a file (negative counts back from the latest)")
+    parser.add_argument("--pending", action="store_true", help="List changes not yet accepted or reverted")
+    parser.add_argument("--accept", nargs="*", metavar=("SERVER", "FILE"), help="Accept pending changes, of every server, one server or some of its files")
+    parser.add_argument("--revert", nargs="*", metavar=("SERVER", "FILE"), help="Restore pending changes from snapshots, of every server, one server or some of its files")
+    parser.add_argument("--quarantine", nargs="+", metavar=("SERVER", "FILE"), help="Move a server out of mcpServers, or some of its files out of its tree, backing them up")
+    parser.add_argument("--release", metavar="SERVER", help="Move a quarantined server back into mcpServers")
+    parser.add_argument("--generations", type=int, default=HISTORY_GENERATIONS, help="Snapshot generations kept per file")
+    parser.add_argument("--paranoid", action="store_true", help="Rehash every file, ignoring the stat cache")
+    parser.add_argument("--hash-algo", choices=["md5", "sha256", "blake2b", "xxh3"], help=f"Digest for file hashes (default: the one in the state, else {DEFAULT_HASH_ALGO})")
+    parser.add_argument("--exclude", action="append", default=[], metavar="GLOB", help="Extra gitignore-style pattern to skip (repeatable)")
+    parser.add_argument("--include", action="append", default=[], metavar="GLOB", help="Track files matching this pattern even with an untracked extension, or re-include an excluded dir (repeatable)")
+    parser.add_argument("--format", choices=["text", "json", "ndjson"], default="text", help="Report format, json and ndjson write per-server and per-file records to stdout (one-off checks then show no overlay)")
+    parser.add_argument("--home", action="append", default=[], type=Path, metavar="DIR", help="Check the profile of this home dir instead of your own (repeatable, fleet mode)")
+    parser.add_argument("--fleet-dir", type=Path, metavar="DIR", help="Where --home profiles keep their state and snapshots (default: MCPMonitor/fleet of the user running it)")
+    parser.add_argument("--root", action="append", default=[], nargs=2, metavar=("CONFIG", "STATE_DIR"), help="Check this config with state kept in STATE_DIR (repeatable, fleet mode)")
+    parser.add_argument("--profile", action="store_true", help="Dump a cProfile and tracemalloc report of each check to MCPMonitor/profiles")
+    parser.add_argument("--jobs", type=int, help="Threads used to hash server trees (1 = serial, default: up to 8, 1 with --low-priority)")
+    parser.add_argument("--low-priority", action="store_true", help=f"Check at idle cpu/io priority, reading at most --read-limit (default {LOW_PRIORITY_READ_LIMIT} MiB/s), entry files first")
+    parser.add_argument("--read-limit", type=float, metavar="MIB", help="Read at most this many MiB/s while hashing")
+    parser.add_argument("--no-content-scan", action="store_true", help="Do not scan added and modified files for suspicious content")
     args = parser.parse_args()
+    if args.jobs is None:
+        args.jobs = 1 if args.low_priority else min(8, os.cpu_count() or 1)
+    if args.hash_algo and args.hash_algo not in HASH_ALGOS:
+        parser.error(f"--hash-algo {args.hash_algo} needs the xxhash package")
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    if args.generations < 1:
+        parser.error("--generations must be at least 1")
+    if args.read_limit is not None and args.read_limit <= 0:
+        parser.error("--read-limit must be positive")
+    fleet_dir = (args.fleet_dir or get_fleet_path()).expanduser()
+    fleet = [(str(home), get_config_path(home), fleet_dir / quote(str(home.expanduser().resolve()), safe=""), home.expanduser()) for home in args.home]
+    fleet += [
+        (config, Path(config).expanduser(), Path(state_dir).expanduser(), home_of_config(Path(config).expanduser()))
+        for config, state_dir in args.root
+    ]
+    if fleet and (args.watch or args.daemon or args.ui or args.status or args.history or args.diff_gen
+                  or args.pending or args.accept is not None or args.revert is not None or args.quarantine or args.release):
+        parser.error("--home and --root only work for one-off checks and --gc")
+    if args.fleet_dir and not args.home:
+        parser.error("--fleet-dir only applies to --home")
+    if args.format == "json" and (args.watch or args.daemon):
+        parser.error("--watch and --daemon never finish a json document, use --format ndjson")
+    if args.format != "text" and (args.gc or args.history or args.diff_gen or args.pending or args.accept is not None
+                                  or args.revert is not None or args.quarantine or args.release):
+        parser.error("--gc, --history, --diff-gen, --pending, --accept, --revert, --quarantine and --release only print text, drop --format")
+    if (args.daemon or args.ui or args.status) and not daemon_supported():
+        parser.error("--daemon, --ui and --status need unix socket support")
+    records = None
+    if args.format == "text":
+        print(logo)
+    else:
+        # stdout only carries records, messages go to stderr
+        records = RecordWriter(args.format, sys.stdout)
+        sys.stdout = sys.stderr
     config_path = get_config_path()
+    algo = args.hash_algo or get_state_meta("hash_algo", DEFAULT_HASH_ALGO)
+    options = ScanOptions(
+        paranoid=args.paranoid,
+        algo=algo,
+        jobs=args.jobs,
+        rules=load_ignore_rules(args.exclude, args.include),
+        generations=args.generations,
+        content_scan=not args.no_content_scan
+    )
+    read_limit = args.read_limit or (LOW_PRIORITY_READ_LIMIT if args.low_priority else None)
+    if read_limit:
+        options.throttle = TokenBucket(read_limit * 1024 * 1024)
+    if args.low_priority:
+        applied = lower_priority()
+        print(f"Low priority: {', '.join(applied + [f'{read_limit:g} MiB/s'])}")
     
+    if args.gc:
+        for label, profile_config, state_dir, home in fleet or [(None, config_path, get_state_path().parent, Path.home())]:
+            with use_profile(profile_config, state_dir, home):
+                # quarantined servers keep their history for when they are released
+                keep = set(get_server_paths(profile_config)) | quarantined_servers(profile_config)
+                removed, freed = gc_snapshots(keep)
+            print(f"{f'[{label}] ' if label else ''}Removed {removed} snapshot object(s), freed {freed / 1024:.1f} KiB")
+        return
+
+    if args.history:
+        server_name = args.history[0]
+        history = load_history(server_name)
+        if len(args.history) == 1:
+            for file_path, entries in history.items():
+                print(f"{file_path}: {len(entries)} generation(s), latest {entries[-1][2] or 'unknown'}")
+        else:
+            for generation, digest, seen in history.get(args.history[1], []):
+                print(f"gen {generation}  {seen or 'unknown':19}  {digest[:12] if digest else 'removed'}")
+        return
+
+    if args.diff_gen:
+        server_name, file_path, gen_a, gen_b = args.diff_gen
+        diff = diff_generations(server_name, file_path, int(gen_a), int(gen_b))
+        if diff is None:
+            print("Generation not found")
+            sys.exit(EXIT_ERROR)
+        sys.stdout.writelines(line if line.endswith("\n") else line + "\n" for line in diff)
+        return
+
+    if args.pending:
+        pending = get_state_meta("pending", {})
+        held = get_state_meta("quarantined_pending", {})
+        for entries_by_server, note in ((pending, ""), (held, "  (quarantined)")):
+            for server_name, entries in entries_by_server.items():
+                for file_path, (before, now) in entries.items():
+                    change = "added" if before is None else "removed" if now is None else "modified"
+                    print(f"{server_name}: {change:8}  {file_path}{note}")
+        if not any(pending.values()) and not any(held.values()):
+            print("No pending changes")
+        return
+
+    if args.accept is not None or args.revert is not None:
+        accepting = args.accept is not None
+        targets = args.accept if accepting else args.revert
+        action = accept_changes if accepting else revert_changes
+        try:
+            done = action(targets[0] if targets else None, targets[1:])
+        except (RuntimeError, OSError) as e:
+            print(f"{'Accept' if accepting else 'Revert'} failed: {e}")
+            sys.exit(EXIT_ERROR)
+        count = sum(len(entries) for entries in done.values())
+        print(f"{'Accepted' if accepting else 'Reverted'} {count} file(s)" if count else "No pending changes")
+        return
+
+    if args.quarantine or args.release:
+        try:
+            if args.release:
+                backup_dir = release(args.release)
+            else:
+                backup_dir = quarantine(args.quarantine[0], args.quarantine[1:])
+        except KeyError as e:
+            print(f"No such server: {e.args[0]}")
+            sys.exit(EXIT_ERROR)
+        print(f"{'Released' if args.release else 'Quarantined'}, backup in {backup_dir}")
+        return
+
+    if args.ui:
+        if not run_ui_client(args.duration):
+            print("No daemon running")
+            sys.exit(EXIT_ERROR)
+        return
+
+    if args.status:
+        status = query_daemon_status()
+        if status is None:
+            print("No daemon running")
+            sys.exit(EXIT_ERROR)
+        status.pop("type")
+        print(json.dumps(status, indent=2))
+        return
+
+    if fleet:
+        # headless, these are other people's profiles
+        exit_code = EXIT_CLEAN
+        results = check_fleet(fleet, options, args.exclude, args.include, args.hash_algo)
+        while True:
+            with profiling(args.profile), metrics.phase("check"):
+                label, profile_config, changed, summary, changes_detail = next(results, (None,) * 5)
+            if label is None:
+                break
+            write_metrics(check_metrics("fleet", changed, options, profile=label))
+            if changed is None:
+                exit_code = EXIT_ERROR
+            elif changed and exit_code == EXIT_CLEAN:
+                exit_code = EXIT_CHANGED
+            if records is None:
+                print(f"[{label}] {'Check failed: ' if changed is None else 'Changes detected: ' if changed else ''}{summary}")
+            elif changed is None:
+                records.write({"profile": label, "type": "error", "error": summary})
+            else:
+                for record in change_records(changed, summary, changes_detail, profile_config, label):
+                    records.write(record)
+            unresolved = sorted(load_config(profile_config).unresolved)
+            if unresolved:
+                warning = f"no home dir known for this config, npx/uvx servers not checked: {', '.join(unresolved)}"
+                if records is None:
+                    print(f"[{label}] Warning: {warning}")
+                else:
+                    records.write({"profile": label, "type": "warning", "warning": warning})
+        if records:
+            records.close()
+        sys.exit(exit_code)
+
     if args.overlay_test:
         show_overlay("MCP Config Changed", "This is a test notification overlay.", duration=args.duration)
         return
@@ -656,13 +4798,27 @@ def main():
     config_path = get_config_path()
     print(f"Monitoring: {config_path}")
     
-    if args.watch:
-        while True:
-            wait_for_claude_startup()
-            changed, summary, changes_detail = check_for_changes()
-            
-            if changed:
-                print(f"Changes detected: {summary}")
+    if args.watch or args.daemon:
+        # overlays run in a --ui client so checks go on while one is open,
+        # without unix sockets --watch shows them in-process like before
+        server = None
+        ui_process = None
+        if daemon_supported():
+            try:
+                server = DaemonServer(get_socket_path())
+            except RuntimeError as e:
+                print(e)
+                sys.exit(EXIT_ERROR)
+            except OSError as e:
+                if args.daemon:
+                    raise
+                print(f"Could not open {get_socket_path()} ({e}), overlays run in-process")
+
+        checks = itertools.count(1)
+
+        def report(summary, changes_detail, check, phase):
+            nonlocal ui_process
+            if server is None:
                 show_overlay(
                     "MCP Changes Detected", 
                     summary,
@@ -670,15 +4826,122 @@ def main():
                     changes=changes_detail,
                     config_path=config_path
                 )
-            else:
-                print(f"No changes. {get_config_summary(config_path)}")
-            
-            while is_claude_running():
-                time.sleep(2)
-            print("Claude closed. Watching for next startup...")
+                return
+            event = {
+                "type": "changes",
+                "title": "MCP Changes Detected",
+                "summary": summary,
+                "changes": changes_detail,
+                "config_path": str(config_path),
+                # a ui updates the overlay of the quick phase with the full one of the same check
+                "check": check,
+                "phase": phase,
+                "time": datetime.now().isoformat()
+            }
+            ui_running = ui_process is not None and ui_process.poll() is None
+            if not server.broadcast(event) and not args.daemon and not ui_running:
+                ui_process = spawn_ui_client(args.duration)
+
+        def run_check(touched):
+            nonlocal watcher
+            check = next(checks)
+            alerted = False
+            with profiling(args.profile):
+                if touched is None:
+                    # full checks raise the alert from the quick phase, before the deep trees are done
+                    with metrics.phase("quick_check"):
+                        alerted, quick_summary, quick_detail = quick = quick_check(options)
+                    if alerted:
+                        print(f"Changes detected: {quick_summary}, checking the rest...")
+                        if records and args.format == "ndjson":
+                            for record in change_records(True, quick_summary, quick_detail, config_path, phase="quick"):
+                                records.write(record)
+                if alerted and server is None:
+                    changed, summary, changes_detail = overlay_while_auditing(quick, options, args.duration, config_path)
+                else:
+                    if alerted:
+                        report(quick_summary, quick_detail, check, "quick")
+                    with metrics.phase("check"):
+                        changed, summary, changes_detail = check_for_changes(options, touched)
+            write_metrics(check_metrics("watch", changed, options, incremental=touched is not None))
+            if server:
+                server.update_status(last_check=datetime.now().isoformat(), last_summary=summary)
+            if changes_detail.get("config_changed"):
+                # server list may have changed, watch the new set of paths
+                watcher.close()
+                watcher = start_watcher(config_path, options.rules)
+            if records:
+                for record in change_records(changed, summary, changes_detail, config_path):
+                    records.write(record)
+            if changed:
+                print(f"Changes detected: {summary}")
+                if server:
+                    server.update_status(last_change=summary)
+            # an alert is always followed by the full result, the in-process overlay already has it
+            if (changed or alerted) and not (alerted and server is None):
+                report(summary, changes_detail, check, "full")
+            return changed
+
+        watcher = start_watcher(config_path, options.rules)
+        first_check = True
+        try:
+            while True:
+                wait_for_claude_startup()
+                if server:
+                    server.update_status(claude_running=True)
+                # nothing was watching before this process started, so the first check is full
+                touched = None if first_check else watcher.drain()
+                first_check = False
+                if not run_check(touched):
+                    print(f"No changes. {get_config_summary(config_path)}")
+                
+                # changes made while claude runs are picked up as they happen,
+                # with a pidfd the wait also ends the moment claude exits
+                while is_claude_running():
+                    pidfd = open_claude_pidfd()
+                    try:
+                        touched = watcher.wait(60 if pidfd is not None else 2, wake_fd=pidfd)
+                    finally:
+                        if pidfd is not None:
+                            os.close(pidfd)
+                    if touched:
+                        run_check(touched)
+                if server:
+                    server.update_status(claude_running=False)
+                print("Claude closed. Watching for next startup...")
+        finally:
+            if server:
+                server.close()
     else:
-        changed, summary, changes_detail = check_for_changes()
-        if changed:
+        try:
+            with profiling(args.profile):
+                with metrics.phase("quick_check"):
+                    quick = quick_check(options)
+                if quick[0] and records is None:
+                    # the overlay goes up now and is updated when the full check is done
+                    print(f"Changes detected: {quick[1]}, checking the rest...")
+                    changed, summary, changes_detail = overlay_while_auditing(quick, options, args.duration, config_path)
+                else:
+                    if quick[0] and args.format == "ndjson":
+                        for record in change_records(True, quick[1], quick[2], config_path, phase="quick"):
+                            records.write(record)
+                    with metrics.phase("check"):
+                        changed, summary, changes_detail = check_for_changes(options)
+        except Exception as e:
+            # an uncaught exception would exit 1, which means changes
+            if records is None:
+                traceback.print_exc()
+            else:
+                records.write({"type": "error", "error": f"{type(e).__name__}: {e}"})
+                records.close()
+            sys.exit(EXIT_ERROR)
+        if records:
+            for record in change_records(changed, summary, changes_detail, config_path):
+                records.write(record)
+            records.close()
+        elif changed and quick[0]:
+            print(f"Changes detected: {summary}")
+        elif changed:
             print(f"Changes detected: {summary}")
             show_overlay(
                 "MCP Changes Detected",
@@ -689,7 +4952,9 @@ def main():
             )
         else:
             print(f"No changes. {get_config_summary(config_path)}")
+        # after the overlay, so tk startup is in there too
+        write_metrics(check_metrics("once", changed, options))
+        sys.exit(EXIT_CHANGED if changed else EXIT_CLEAN)
 
 if __name__ == "__main__":
-    print(logo)
     main()
\ No newline at end of file